@@ -1,105 +1,496 @@
 import argparse
+import asyncio
 import json
-import traceback
-from concurrent.futures import Future, ThreadPoolExecutor, as_completed
-from dataclasses import asdict
+import sys
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, replace
 from datetime import datetime
+from itertools import product
 from pathlib import Path
+from typing import Any, TypeVar
 
-from rich.progress import track
+from rich.console import Console
+from rich.markup import escape
+from rich.table import Table
 
-from benchmarks import (
-    benchmark_comfy,
-    benchmark_diffusers,
-    benchmark_experimental,
-    benchmark_minsdxl,
-    benchmark_oneflow,
-    benchmark_stablefast,
-    benchmark_tensorrt,
+from benchmarks.executors import (
+    DEFAULT_VENVS_DIR,
+    EXECUTORS,
+    Executor,
+    create_executor,
+    executor_capacity,
+    group_key,
 )
-from benchmarks.settings import BenchmarkSettings, InputParameters
-
-ALL_BENCHMARKS = [
-    *benchmark_diffusers.LOCAL_BENCHMARKS,
-    *benchmark_tensorrt.LOCAL_BENCHMARKS,
-    *benchmark_oneflow.LOCAL_BENCHMARKS,
-    *benchmark_minsdxl.LOCAL_BENCHMARKS,
-    *benchmark_experimental.LOCAL_BENCHMARKS,
-    *benchmark_comfy.LOCAL_BENCHMARKS,
-    *benchmark_stablefast.LOCAL_BENCHMARKS,
-]
-
-
-def load_previous_timings(
-    session_file: Path,
-    settings: BenchmarkSettings,
-    parameters: InputParameters,
-) -> dict[tuple[str, str], list[float]]:
+from benchmarks.failures import RetryPolicy, describe_error
+from benchmarks.history import record_session
+from benchmarks.images import write_image
+from benchmarks.loadtest import CLOSED_LOOP, OPEN_LOOP, LoadTestSettings
+from benchmarks.matrix import Selection, benchmark_tags, format_tag
+from benchmarks.profiling import StackSampler, write_profile
+from benchmarks.registry import BENCHMARK_MODULES, load_benchmarks, resolve
+from benchmarks.scheduler import (
+    BenchmarkProgress,
+    GpuSlots,
+    duration_history,
+    longest_first,
+)
+from benchmarks.session import (
+    SessionJournal,
+    benchmark_runtime,
+    cache_key,
+    pack_timings,
+    parameters_key,
+    write_session,
+)
+from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParameters
+
+# The parameters every benchmark is run with, besides the sweeps.
+BASE_PARAMETERS = InputParameters(prompt="A photo of a cat", steps=50)
+
+
+def load_previous_results(session_file: Path) -> dict[str, dict]:
     if not session_file.exists():
         return {}
 
     with open(session_file) as stream:
         results = json.load(stream)
 
-    if results["settings"] != asdict(settings):
-        print(f"Settings mismatch: {results['settings']} != {asdict(settings)}")
-        print(f"Skipping {session_file}")
-        return {}
-
-    if results["parameters"] != asdict(parameters):
-        print(f"Parameters mismatch: {results['parameters']} != {asdict(parameters)}")
-        print(f"Skipping {session_file}")
-        return {}
-
+    # Results are keyed by the hash of their benchmark's definition, so only
+    # the ones whose definition (or settings/parameters) changed are re-run.
     return {
-        (timing["category"], timing["name"]): timing["timings"]
+        timing["cache_key"]: timing
         for timing in results["timings"]
+        if "cache_key" in timing
     }
 
 
-def run_benchmark(
-    benchmark_key: tuple[str, str],
-    benchmark: dict,
-    settings: BenchmarkSettings,
+def sweep_parameters(
     parameters: InputParameters,
     options: argparse.Namespace,
-):
-    print(f"Running benchmark: {benchmark_key}")
-    function = benchmark["function"].on(
-        machine_type=options.machine_type,
-        _scheduler="nomad",
-    )
-    if options.target_node:
-        function = function.on(
-            _scheduler_options={
-                "target_node": options.target_node,
-            }
-        )
+) -> list[InputParameters]:
+    # Each sweep only changes a single parameter at a time, the rest of
+    # them are kept as the base parameters.
+    variants = [parameters]
+    for batch_size in options.batch_sizes:
+        variants.append(replace(parameters, batch_size=batch_size))
+    for width, height in options.resolutions:
+        variants.append(replace(parameters, width=width, height=height))
+    for steps in options.step_counts:
+        variants.append(replace(parameters, steps=steps))
 
-    if options.datacenters:
-        function = function.on(
-            _scheduler_options={
-                "datacenters": options.datacenters,
-            }
-        )
+    return list(
+        {parameters_key(asdict(variant)): variant for variant in variants}.values()
+    )
 
-    benchmark_results = function(
-        benchmark_settings=settings,
-        parameters=parameters,
-        **benchmark.get("kwargs", {}),
+
+def describe_parameters(parameters: dict) -> str:
+    return ", ".join(
+        f"{key}={value}"
+        for key, value in parameters.items()
+        if key != "prompt" and value is not None
     )
-    return {
-        "name": benchmark["name"],
-        "category": benchmark["category"],  # "SD1.5", "SDXL"
-        "timings": benchmark_results.timings,
+
+
+def resolution(value: str) -> tuple[int, int]:
+    width, _, height = value.partition("x")
+    return int(width), int(height)
+
+
+def add_registry_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--benchmark-module",
+        dest="benchmark_modules",
+        action="append",
+        help="Only collect the benchmarks from the given module(s) (can be "
+        "passed multiple times). Defaults to all the modules in this package.",
+    )
+    parser.add_argument(
+        "--no-index",
+        dest="use_index",
+        action="store_false",
+        help="Import every benchmark module up front rather than reading their "
+        "benchmarks from the index (and only importing the ones that run).",
+    )
+
+
+def check_selections(
+    parser: argparse.ArgumentParser,
+    selections: list[Selection | None],
+    all_benchmarks: list[dict],
+    all_parameters: list[InputParameters],
+) -> None:
+    known_keys = {
+        key
+        for benchmark, benchmark_parameters in product(all_benchmarks, all_parameters)
+        for key in benchmark_tags(benchmark, asdict(benchmark_parameters))
     }
+    for selection in selections:
+        if selection is not None and (unknown := selection.unknown_keys(known_keys)):
+            parser.error(
+                f"Unknown selection keys: {', '.join(sorted(unknown))} "
+                f"(known: {', '.join(sorted(known_keys))})"
+            )
+
+
+def list_benchmarks(args: list[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks list",
+        description="List the benchmarks (and the tags they can be selected by) "
+        "without running them.",
+    )
+    parser.add_argument(
+        "--select",
+        type=Selection.parse,
+        action="append",
+        default=[],
+        help="Only list the benchmarks that match this selection (see the "
+        "--select option of the runs).",
+    )
+    add_registry_arguments(parser)
+
+    options = parser.parse_args(args)
+    all_benchmarks = load_benchmarks(
+        options.benchmark_modules or BENCHMARK_MODULES, use_index=options.use_index
+    )
+    check_selections(parser, options.select, all_benchmarks, [BASE_PARAMETERS])
+
+    table = Table("Category", "Name", "Backend", "Options")
+    for benchmark in all_benchmarks:
+        if options.select and not any(
+            selection.matches(benchmark, asdict(BASE_PARAMETERS))
+            for selection in options.select
+        ):
+            continue
+
+        tags = benchmark.get("tags", {})
+        table.add_row(
+            escape(benchmark["category"]),
+            escape(benchmark["name"]),
+            tags.get("backend", ""),
+            escape(
+                ", ".join(
+                    f"{key}={format_tag(value)}"
+                    for key, value in tags.items()
+                    if key not in ("backend", "model")
+                )
+            ),
+        )
+
+    with Console() as console:
+        console.print(table)
+
+
+T = TypeVar("T")
+
+
+@dataclass
+class PendingBenchmark:
+    key: tuple[str, str, str]
+    cache_key: str
+    benchmark: dict
+    parameters: InputParameters
+
+
+class SessionRunner:
+    """Runs the pending benchmarks of a session, a group of them per GPU at a
+    time, and collects their results (and failures).
+    """
+
+    def __init__(
+        self,
+        settings: BenchmarkSettings,
+        executor: Executor,
+        capacity: int,
+        journal: SessionJournal,
+        retries: RetryPolicy,
+        profiles_dir: Path,
+        images_dir: Path,
+    ) -> None:
+        self.settings = settings
+        self.executor = executor
+        self.capacity = capacity
+        self.journal = journal
+        self.retries = retries
+        self.profiles_dir = profiles_dir
+        self.images_dir = images_dir
+        self.results: list[dict] = []
+        self.failures: list[dict] = []
+        self.saved = 0.0
+
+    async def run(self, groups: list[list[PendingBenchmark]]) -> None:
+        self.slots = GpuSlots(self.capacity)
+        total = sum(map(len, groups))
+        with (
+            BenchmarkProgress(total) as self.progress,
+            ThreadPoolExecutor(self.capacity) as self.pool,
+        ):
+            for group in groups:
+                for pending in group:
+                    category, name, _ = pending.key
+                    description = describe_parameters(asdict(pending.parameters))
+                    self.progress.add(
+                        pending.key, f"{category} / {name} ({description})"
+                    )
+
+            await asyncio.gather(*map(self.run_group, groups))
+
+        print(
+            f"Ran {total} benchmarks on {len(groups)} workers "
+            f"({self.capacity} at a time), saving ~{self.saved:.1f}s of cold starts"
+        )
+
+    async def run_group(self, group: list[PendingBenchmark]) -> None:
+        """Run a group of benchmarks (sharing the same group_key) on a single
+        worker, once a GPU is free for it.
+        """
+        async with self.slots.acquire() as gpu:
+            all_results = self.executor.run_group(
+                [
+                    (pending.benchmark, self.settings, pending.parameters)
+                    for pending in group
+                ],
+                gpu=gpu,
+            )
+            try:
+                failed = await self._consume_group(group, all_results)
+            finally:
+                # Shuts down the worker (if any) before the GPU is handed over.
+                await self._in_thread(all_results.close)
+
+        # Retried once the group is done and its GPU is handed over, so that
+        # it isn't left idle during the backoff.
+        await asyncio.gather(
+            *(self._retry(pending, error) for pending, error in failed)
+        )
+
+    async def _consume_group(
+        self,
+        group: list[PendingBenchmark],
+        all_results: Iterator[BenchmarkResults | Exception],
+    ) -> list[tuple[PendingBenchmark, Exception]]:
+        cold_start = None
+        worker_failure = None
+        failed = []
+        for position, pending in enumerate(group):
+            self.progress.start(pending.key)
+            t0 = time.perf_counter()
+            if worker_failure is not None:
+                benchmark_results = worker_failure
+            else:
+                try:
+                    benchmark_results = await self._in_thread(next, all_results)
+                except Exception as exc:
+                    # The worker itself failed (e.g. its environment couldn't
+                    # be built), so does every benchmark that was left on it,
+                    # unless the failure is worth retrying.
+                    benchmark_results = worker_failure = exc
+            wall_time = time.perf_counter() - t0
+
+            if isinstance(benchmark_results, Exception):
+                failed.append((pending, benchmark_results))
+                continue
+
+            worker = {"position": position, "wall_time": wall_time, "attempts": 1}
+            result = self._result(pending, benchmark_results, worker)
+            overhead = max(wall_time - benchmark_runtime(result), 0.0)
+            if cold_start is None:
+                cold_start = overhead
+            elif position:
+                self.saved += max(cold_start - overhead, 0.0)
+            self._complete(pending, result)
+        return failed
+
+    async def _retry(self, pending: PendingBenchmark, failure: Exception) -> None:
+        attempt = 1
+        benchmark_results: BenchmarkResults | Exception = failure
+        while isinstance(benchmark_results, Exception):
+            error = describe_error(benchmark_results)
+            if not self.retries.should_retry(error, attempt):
+                self._fail(pending, error, attempt)
+                return
+
+            delay = self.retries.delay(attempt)
+            self.progress.print(
+                f"Retrying {pending.key} in {delay:.0f}s after {error['type']} "
+                f"(attempt {attempt + 1}/{self.retries.max_attempts})"
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+            async with self.slots.acquire() as gpu:
+                t0 = time.perf_counter()
+                benchmark_results = await self._in_thread(self._run_alone, pending, gpu)
+                wall_time = time.perf_counter() - t0
+
+        # Retries run on a fresh worker, so they are not warm anymore.
+        worker = {"position": 0, "wall_time": wall_time, "attempts": attempt}
+        self._complete(pending, self._result(pending, benchmark_results, worker))
+
+    def _result(
+        self,
+        pending: PendingBenchmark,
+        benchmark_results: BenchmarkResults,
+        worker: dict[str, Any],
+    ) -> dict:
+        result = {
+            "name": pending.benchmark["name"],
+            "category": pending.benchmark["category"],  # "SD1.5", "SDXL"
+            "parameters": asdict(pending.parameters),
+            "cache_key": pending.cache_key,
+            "timings": benchmark_results.timings,
+            "relative_error": benchmark_results.relative_error,
+            "warmup_timings": benchmark_results.warmup_timings,
+            "setup_timings": benchmark_results.setup_timings,
+            "memory": benchmark_results.memory,
+            "load_test": benchmark_results.load_test,
+            "stage_timings": benchmark_results.stage_timings,
+            "step_timings": [
+                pack_timings(step_timings)
+                for step_timings in benchmark_results.step_timings
+            ],
+            "telemetry": benchmark_results.telemetry,
+            "compile_cache": benchmark_results.compile_cache,
+            "worker": worker,
+        }
+        if benchmark_results.image is not None:
+            result["image"] = write_image(
+                self.images_dir,
+                f"{result['category']} {result['name']} {pending.cache_key[:8]}",
+                benchmark_results.image,
+            )
+        if benchmark_results.profile is not None:
+            result["profile"] = write_profile(
+                self.profiles_dir,
+                f"{result['category']} {result['name']} {pending.cache_key[:8]}",
+                benchmark_results.profile,
+            )
+        return result
+
+    def _run_alone(
+        self,
+        pending: PendingBenchmark,
+        gpu: int,
+    ) -> BenchmarkResults | Exception:
+        # Retries get a fresh worker, rather than the one the failure might
+        # have left in a bad state (e.g. with fragmented memory), except with
+        # the in-process executor which has none.
+        all_results = self.executor.run_group(
+            [(pending.benchmark, self.settings, pending.parameters)],
+            gpu=gpu,
+            fresh=True,
+        )
+        try:
+            return next(all_results)
+        except Exception as exc:
+            return exc
+        finally:
+            all_results.close()
+
+    async def _in_thread(self, function: Callable[..., T], *args: Any) -> T:
+        # The executors block (on fal calls or worker processes), so they run
+        # on their own threads while the loop keeps the other groups and the
+        # progress display going.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, function, *args)
+
+    def _complete(self, pending: PendingBenchmark, result: dict) -> None:
+        self.journal.append(result)
+        self.progress.print(
+            f"Finished {(result['category'], result['name'])} "
+            f"({describe_parameters(result['parameters'])}) in "
+            f"{len(result.get('warmup_timings', []))} warmup and "
+            f"{len(result['timings'])} timed iterations "
+            f"(±{(result.get('relative_error') or float('nan')):.2%})"
+        )
+        if flagged := (result["telemetry"] or {}).get("flagged_iterations"):
+            self.progress.print(
+                f"Warning: {len(flagged)} timed iterations of {pending.key} ran on "
+                "a throttled GPU or alongside other processes"
+            )
+        self.progress.finish(pending.key, "done")
+        self.results.append(result)
+
+    def _fail(self, pending: PendingBenchmark, error: dict, attempts: int) -> None:
+        self.progress.print(f"Benchmark {pending.key} failed!!")
+        self.progress.print(error["traceback"])
+        self.progress.finish(pending.key, "failed")
+        self.failures.append(
+            {
+                "name": pending.benchmark["name"],
+                "category": pending.benchmark["category"],
+                "parameters": asdict(pending.parameters),
+                "cache_key": pending.cache_key,
+                "error": error,
+                "attempts": attempts,
+            }
+        )
 
 
 def main() -> None:
-    parser = argparse.ArgumentParser()
+    if sys.argv[1:2] == ["list"]:
+        list_benchmarks(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(
+        epilog="Use `python -m benchmarks list` to list the benchmarks instead."
+    )
     parser.add_argument("results_dir", type=Path)
     parser.add_argument("--warmup-iterations", type=int, default=3)
+    parser.add_argument(
+        "--warmup-tolerance",
+        type=float,
+        default=None,
+        help="Keep warming up (after --warmup-iterations) until the last "
+        "--warmup-window iterations are within this relative tolerance of "
+        "each other.",
+    )
+    parser.add_argument("--warmup-window", type=int, default=3)
+    parser.add_argument("--max-warmup-iterations", type=int, default=20)
     parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument(
+        "--target-relative-error",
+        type=float,
+        default=None,
+        help="Instead of running a fixed number of iterations, keep running until "
+        "the 95%% confidence interval of the median is within this relative error "
+        "(e.g. 0.005 for ±0.5%%).",
+    )
+    parser.add_argument("--min-iterations", type=int, default=6)
+    parser.add_argument("--max-iterations", type=int, default=50)
+    parser.add_argument(
+        "--stage-iterations",
+        type=int,
+        default=0,
+        help="Number of extra iterations to collect the per-stage (text encoder, "
+        "UNet, VAE) breakdown and the per-step denoising latency from.",
+    )
+    parser.add_argument(
+        "--capture-image",
+        action="store_true",
+        help="Also save an image generated from a fixed seed by each benchmark "
+        "(when supported), for benchmarks.fidelity to compare against the "
+        "reference implementation.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile one extra iteration of each benchmark with torch.profiler, "
+        "and the orchestration itself with a Python stack sampler. The traces "
+        "are saved next to the session file.",
+    )
+    parser.add_argument(
+        "--load-test",
+        choices=[OPEN_LOOP, CLOSED_LOOP],
+        default=None,
+        help="After the timed iterations, drive each pipeline with concurrent "
+        "requests: either open-loop arrivals at --load-test-qps or closed-loop "
+        "with --load-test-concurrency clients.",
+    )
+    parser.add_argument("--load-test-qps", type=float, default=1.0)
+    parser.add_argument("--load-test-concurrency", type=int, default=4)
+    parser.add_argument("--load-test-requests", type=int, default=50)
+    parser.add_argument("--load-test-workers", type=int, default=1)
     parser.add_argument(
         "--session-id",
         type=str,
@@ -112,102 +503,290 @@ def main() -> None:
     )
     parser.add_argument(
         "--force-run-only",
-        type=str.lower,
-        help="Force running only the specified benchmarks, even if they have already been run.",
-        choices=[
-            "diffusers",
-            "tensorrt",
-            "minsdxl",
-            "oneflow",
-            "consistency",
-            "comfy",
-            "stablefast",
-        ],
+        type=Selection.parse,
+        help="Force running only the benchmarks that match the given selection "
+        "(see --select, e.g. a part of their name), even if they have already "
+        "been run.",
     )
+    parser.add_argument(
+        "--select",
+        type=Selection.parse,
+        action="append",
+        default=[],
+        help="Only consider the benchmarks that match this selection, like "
+        "'backend=diffusers,compile=true,category=SDXL*': comma separated "
+        "key=pattern (or key!=pattern) conditions on their name, category, "
+        "backend, model, options and parameters, with glob patterns and '|' "
+        "between alternatives. Can be repeated to select the benchmarks that "
+        "match any of them. The results of the others are kept as they were.",
+    )
+    parser.add_argument(
+        "--batch-sizes",
+        type=int,
+        nargs="*",
+        default=[],
+        help="Additionally run every benchmark with each of the given batch sizes.",
+    )
+    parser.add_argument(
+        "--resolutions",
+        type=resolution,
+        nargs="*",
+        default=[],
+        help="Additionally run every benchmark with each of the given resolutions "
+        "(as WIDTHxHEIGHT, e.g. 768x768).",
+    )
+    parser.add_argument(
+        "--step-counts",
+        type=int,
+        nargs="*",
+        default=[],
+        help="Additionally run every benchmark with each of the given number of "
+        "inference steps, to separate the fixed overhead from the per-step cost.",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=EXECUTORS,
+        default="fal",
+        help="Where to run the benchmarks: on fal's GPU workers, locally in a "
+        "subprocess with a virtualenv built from each benchmark's requirements, "
+        "or in the current process.",
+    )
+    parser.add_argument(
+        "--venvs-dir",
+        type=Path,
+        default=DEFAULT_VENVS_DIR,
+        help="Where to cache the virtualenvs of the subprocess executor.",
+    )
+    add_registry_arguments(parser)
     parser.add_argument(
         "--machine-type",
         type=str,
         default="GPU",
         choices=["GPU", "GPU-A6000"],
     )
+    parser.add_argument(
+        "--keep-alive",
+        type=int,
+        default=300,
+        help="Seconds to keep fal workers alive after each call, so that "
+        "benchmarks sharing an environment reuse the same warm worker.",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=3,
+        help="Attempts for each benchmark when it fails with a transient error "
+        "(out of memory, lost worker, network errors).",
+    )
+    parser.add_argument(
+        "--retry-budget",
+        type=int,
+        default=10,
+        help="Maximum number of retries for the whole session.",
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        type=float,
+        default=30.0,
+        help="Seconds before the first retry of a benchmark, doubled for each "
+        "of the next ones.",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=8,
+        help="How many benchmarks to run at once on fal (when not pinned to a "
+        "single node with --target-node).",
+    )
+    parser.add_argument(
+        "--gpus-per-node",
+        type=int,
+        default=None,
+        help="Number of GPUs of the node (local, or --target-node); at most "
+        "one benchmark runs on each. Detected locally with nvidia-smi and "
+        "defaults to 8 for fal nodes.",
+    )
+    parser.add_argument(
+        "--max-group-size",
+        type=int,
+        default=None,
+        help="Split the benchmarks that share a worker into groups of at most "
+        "this size, trading cold starts for parallelism.",
+    )
 
     # For ensuring consistency among results, make sure to compare the numbers
     # within the same node. So the driver, cuda version, power supply, CPU compute
     # etc. are all the same.
     parser.add_argument("--target-node", type=str, default=None)
     parser.add_argument("--datacenters", type=str, nargs="*")
+    parser.add_argument(
+        "--history",
+        type=Path,
+        default=None,
+        help="SQLite database to also record the session in, for querying the "
+        "results over time with benchmarks.history.",
+    )
 
     options = parser.parse_args()
     session_file = options.results_dir / f"{options.session_id}.json"
+    profiles_dir = options.results_dir / f"{options.session_id}.profiles"
 
-    settings = BenchmarkSettings(
-        warmup_iterations=options.warmup_iterations,
-        benchmark_iterations=options.iterations,
+    load_test = None
+    if options.load_test:
+        load_test = LoadTestSettings(
+            mode=options.load_test,
+            qps=options.load_test_qps,
+            concurrency=options.load_test_concurrency,
+            requests=options.load_test_requests,
+            workers=options.load_test_workers,
+        )
+
+    try:
+        settings = BenchmarkSettings(
+            warmup_iterations=options.warmup_iterations,
+            warmup_tolerance=options.warmup_tolerance,
+            warmup_window=options.warmup_window,
+            max_warmup_iterations=options.max_warmup_iterations,
+            benchmark_iterations=options.iterations,
+            target_relative_error=options.target_relative_error,
+            min_iterations=options.min_iterations,
+            max_iterations=options.max_iterations,
+            stage_iterations=options.stage_iterations,
+            load_test=load_test,
+            profile=options.profile,
+            capture_image=options.capture_image,
+        )
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    parameters = BASE_PARAMETERS
+
+    all_benchmarks = load_benchmarks(
+        options.benchmark_modules or BENCHMARK_MODULES, use_index=options.use_index
+    )
+    all_parameters = sweep_parameters(parameters, options)
+    check_selections(
+        parser,
+        [*options.select, options.force_run_only],
+        all_benchmarks,
+        all_parameters,
     )
-    parameters = InputParameters(prompt="A photo of a cat", steps=50)
+
+    executor = create_executor(options)
 
     timings = []
-    previous_timings = load_previous_timings(session_file, settings, parameters)
+    previous_results = load_previous_results(session_file)
 
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        benchmark_futures = []
+    # Results of an interrupted run of this session are always reused, even
+    # when forced to re-run, since they were produced by this very run.
+    journal = SessionJournal(session_file)
+    journaled_results = {
+        result["cache_key"]: result for result in journal.start(asdict(settings))
+    }
 
-        for benchmark in ALL_BENCHMARKS:
-            benchmark_key = (benchmark["category"], benchmark["name"])
-            should_skip = benchmark.get("skip_if", False)
-            should_force_run = options.force_run or (
-                options.force_run_only
-                and options.force_run_only in benchmark["name"].lower()
-            )
-            if benchmark_key in previous_timings and (
-                not should_force_run or should_skip
-            ):
-                print(f"Skipping {benchmark_key} (already run)")
-                future = Future()  # type: ignore
-                future.set_result(
-                    {
-                        "name": benchmark["name"],
-                        "category": benchmark["category"],
-                        "timings": previous_timings[benchmark_key],
-                    }
-                )
-                benchmark_futures.append(future)
-                continue
+    groups: dict[tuple[str, ...], list[PendingBenchmark]] = {}
+    for benchmark, benchmark_parameters in product(all_benchmarks, all_parameters):
+        benchmark_key = (
+            benchmark["category"],
+            benchmark["name"],
+            parameters_key(asdict(benchmark_parameters)),
+        )
+        benchmark_cache_key = cache_key(
+            benchmark, asdict(settings), asdict(benchmark_parameters)
+        )
+        should_skip = benchmark.get("skip_if", False)
+        should_force_run = options.force_run or (
+            options.force_run_only is not None
+            and options.force_run_only.matches(benchmark, asdict(benchmark_parameters))
+        )
+        if options.select and not any(
+            selection.matches(benchmark, asdict(benchmark_parameters))
+            for selection in options.select
+        ):
+            # Left out of this run, but not out of the session.
+            if benchmark_cache_key in previous_results:
+                timings.append(previous_results[benchmark_cache_key])
+            continue
 
-            benchmark_futures.append(
-                executor.submit(
-                    run_benchmark,
-                    benchmark_key,
-                    benchmark,
-                    settings,
-                    parameters,
-                    options,
-                )
-            )
+        if benchmark_cache_key in journaled_results:
+            print(f"Skipping {benchmark_key} (resumed from the journal)")
+            timings.append(journaled_results[benchmark_cache_key])
+            continue
 
-        for future in track(
-            as_completed(benchmark_futures),
-            total=len(benchmark_futures),
-            description="Running benchmarks",
+        if benchmark_cache_key in previous_results and (
+            not should_force_run or should_skip
         ):
-            try:
-                result = future.result()
-            except Exception as exc:
-                print("Benchmark failed!!")
-                traceback.print_exc()
-                continue
-            else:
-                timings.append(result)
+            print(f"Skipping {benchmark_key} (already run)")
+            timings.append(previous_results[benchmark_cache_key])
+            continue
+
+        # Only the benchmarks that actually run have their module imported.
+        benchmark = resolve(benchmark)
+        groups.setdefault(group_key(benchmark), []).append(
+            PendingBenchmark(
+                key=benchmark_key,
+                cache_key=benchmark_cache_key,
+                benchmark=benchmark,
+                parameters=benchmark_parameters,
+            )
+        )
+
+    group_size = options.max_group_size or max(map(len, groups.values()), default=1)
+    all_groups = [
+        group[start : start + group_size]
+        for group in groups.values()
+        for start in range(0, len(group), group_size)
+    ]
+    history = duration_history(
+        [*previous_results.values(), *journaled_results.values()]
+    )
+    runner = SessionRunner(
+        settings,
+        executor,
+        capacity=executor_capacity(options),
+        journal=journal,
+        retries=RetryPolicy(
+            max_attempts=options.max_attempts,
+            budget=options.retry_budget,
+            backoff=options.retry_backoff,
+        ),
+        profiles_dir=profiles_dir,
+        images_dir=options.results_dir / f"{options.session_id}.images",
+    )
+
+    # The orchestration itself (scheduling, executors, result handling) is
+    # profiled by sampling its Python stacks.
+    sampler = StackSampler() if options.profile else None
+    if sampler is not None:
+        sampler.start()
+    try:
+        asyncio.run(runner.run(longest_first(all_groups, history)))
+    finally:
+        if sampler is not None:
+            sampler.stop()
+            sampler.write(profiles_dir / "orchestration.folded")
+    timings.extend(runner.results)
 
     results = {
         "settings": asdict(settings),
         "parameters": asdict(parameters),
         "timings": timings,
+        # Only the failures of this run; they are always retried by the next.
+        "failures": runner.failures,
+        # Where the session ran, to only compare results from the same place
+        # across sessions.
+        "environment": {
+            "executor": options.executor,
+            "target_node": options.target_node,
+            "datacenters": options.datacenters,
+        },
     }
 
-    with open(session_file, "w") as stream:
-        json.dump(results, stream)
-        stream.write("\n")
+    write_session(session_file, results)
+    journal.remove()
+
+    if options.history is not None:
+        record_session(options.history, options.session_id, results)
 
 
 if __name__ == "__main__":
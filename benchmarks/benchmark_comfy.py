@@ -3,6 +3,15 @@ from __future__ import annotations
 import fal
 from fal.toolkit import clone_repository, download_file
 
+from benchmarks.instrumentation import (
+    LOAD,
+    TEXT_ENCODER,
+    UNET,
+    VAE_DECODE,
+    StageTimer,
+    StepTimer,
+)
+from benchmarks.matrix import BenchmarkMatrix, Variant
 from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParameters
 
 
@@ -24,6 +33,7 @@ from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParame
         "huggingface_hub",
         "accelerate==0.24.1",
         "xformers==0.0.22.post7",
+        "nvidia-ml-py",
     ],
     machine_type="GPU",
 )
@@ -33,18 +43,21 @@ def comfy_sdxl(
 ) -> BenchmarkResults:
     import sys
 
-    comfy_repo = clone_repository(
-        "https://github.com/comfyanonymous/ComfyUI.git",
-        commit_hash="2a23ba0b8c225b59902423ef08db0de39d2ed7e7",
-    )
-    sys.path.insert(0, str(comfy_repo))
+    setup = StageTimer(enabled=True)
+    with setup.stage(LOAD):
+        comfy_repo = clone_repository(
+            "https://github.com/comfyanonymous/ComfyUI.git",
+            commit_hash="2a23ba0b8c225b59902423ef08db0de39d2ed7e7",
+        )
+        sys.path.insert(0, str(comfy_repo))
 
-    download_file(
-        "https://huggingface.co/stabilityai/stable-diffusion-xl-base-1.0/resolve/main/sd_xl_base_1.0.safetensors?download=true",
-        comfy_repo / "models" / "checkpoints",
-        file_name="sd_xl_base_1.0.safetensors",
-    )
+        download_file(
+            "https://huggingface.co/stabilityai/stable-diffusion-xl-base-1.0/resolve/main/sd_xl_base_1.0.safetensors?download=true",
+            comfy_repo / "models" / "checkpoints",
+            file_name="sd_xl_base_1.0.safetensors",
+        )
 
+    import latent_preview
     import numpy as np
     import torch
     from nodes import (
@@ -62,42 +75,73 @@ def comfy_sdxl(
     k_sampler = KSampler()
     vae_decode = VAEDecode()
 
-    (
-        model,
-        clip,
-        vae,
-    ) = checkpoint_loader_simple.load_checkpoint(ckpt_name="sd_xl_base_1.0.safetensors")
+    # Comfy loads the weights on the CPU and moves them to the device lazily,
+    # as part of the first inference.
+    with setup.stage(LOAD):
+        model, clip, vae = checkpoint_loader_simple.load_checkpoint(
+            ckpt_name="sd_xl_base_1.0.safetensors"
+        )
+
+    stages = StageTimer(synchronize=torch.cuda.synchronize)
+    steps = StepTimer(synchronize=torch.cuda.synchronize)
+
+    # KSampler doesn't take a step callback, but builds one (for the latent
+    # previews) with prepare_callback on each call.
+    prepare_callback = latent_preview.prepare_callback
+
+    def prepare_step_callback(*args, **kwargs):
+        preview_callback = prepare_callback(*args, **kwargs)
+
+        def callback(*callback_args):
+            steps.step()
+            return preview_callback(*callback_args)
+
+        return callback
+
+    latent_preview.prepare_callback = prepare_step_callback
 
     @torch.inference_mode
     def inference_func():
-        (latent,) = empty_latent_image.generate(width=1024, height=1024, batch_size=1)
-        (conditioning,) = clip_text_encode.encode(text="", clip=clip)
-        (conditioning_2,) = clip_text_encode.encode(text=parameters.prompt, clip=clip)
-        (latent_2,) = k_sampler.sample(
-            seed=0,
-            steps=parameters.steps,
-            cfg=7.5,
-            sampler_name="euler",
-            scheduler="normal",
-            denoise=1,
-            model=model,
-            positive=conditioning_2,
-            negative=conditioning,
-            latent_image=latent,
+        (latent,) = empty_latent_image.generate(
+            width=parameters.width or 1024,
+            height=parameters.height or 1024,
+            batch_size=parameters.batch_size,
         )
-        (images,) = vae_decode.decode(samples=latent_2, vae=vae)
+        with stages.stage(TEXT_ENCODER):
+            (conditioning,) = clip_text_encode.encode(text="", clip=clip)
+            (conditioning_2,) = clip_text_encode.encode(
+                text=parameters.prompt, clip=clip
+            )
+        with stages.stage(UNET):
+            steps.start()
+            (latent_2,) = k_sampler.sample(
+                seed=0,
+                steps=parameters.steps,
+                cfg=7.5,
+                sampler_name="euler",
+                scheduler="normal",
+                denoise=1,
+                model=model,
+                positive=conditioning_2,
+                negative=conditioning,
+                latent_image=latent,
+            )
+        with stages.stage(VAE_DECODE):
+            (images,) = vae_decode.decode(samples=latent_2, vae=vae)
         for image in images:
             i = 255.0 * image.cpu().numpy()
             img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
         return img
 
-    return benchmark_settings.apply(inference_func)
+    return benchmark_settings.apply(
+        inference_func, stages=stages, setup=setup, steps=steps
+    )
 
 
-LOCAL_BENCHMARKS = [
-    {
-        "name": "Comfy (torch 2.1, xformers)",
-        "category": "SDXL (End-to-end)",
-        "function": comfy_sdxl,
-    },
-]
+LOCAL_BENCHMARKS = BenchmarkMatrix(
+    backend="comfy",
+    function=comfy_sdxl,
+    models={"SDXL": {}},
+    options={"attention": "xformers", "compile": False},
+    variants=[Variant("Comfy (torch 2.1, xformers)")],
+).expand()
@@ -1,13 +1,60 @@
 from __future__ import annotations
 
-import os
+import gc
+from contextlib import ExitStack
 from functools import partial
+from typing import Any
 
 import fal
 
+from benchmarks.compile_cache import CompileCache, torch_compile_cache
+from benchmarks.images import seeded_image
+from benchmarks.instrumentation import (
+    COMPILE,
+    LOAD,
+    TO_DEVICE,
+    StageTimer,
+    instrument_diffusers_pipeline,
+    instrument_diffusers_steps,
+)
+from benchmarks.matrix import BenchmarkMatrix, Variant
 from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParameters
 
 
+@fal.cached
+def base_pipelines() -> dict[str, tuple[Any, dict[str, float]]]:
+    # Survives between the calls that land on the same warm worker, so all
+    # the variants of a model share a single copy of its weights.
+    return {}
+
+
+def load_base_pipeline(model_name: str) -> tuple[Any, dict[str, float]]:
+    import torch
+    from diffusers import DiffusionPipeline
+
+    pipelines = base_pipelines()
+    if model_name not in pipelines:
+        # Only one model is kept around at a time, otherwise the resident
+        # memory of one would show up in the memory stats of the other.
+        pipelines.clear()
+        gc.collect()
+        torch.cuda.empty_cache()
+
+        setup = StageTimer(enabled=True)
+        with setup.stage(LOAD):
+            pipeline = DiffusionPipeline.from_pretrained(
+                model_name,
+                torch_dtype=torch.float16,
+                use_safetensors=True,
+            )
+
+        with setup.stage(TO_DEVICE):
+            pipeline.to("cuda")
+
+        pipelines[model_name] = pipeline, setup.collect()
+    return pipelines[model_name]
+
+
 @fal.function(
     requirements=[
         "accelerate==0.24.1",
@@ -15,6 +62,7 @@ from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParame
         "torch==2.1.0",
         "transformers==4.35.0",
         "xformers==0.0.22.post7",
+        "nvidia-ml-py",
     ],
     machine_type="GPU",
 )
@@ -27,140 +75,123 @@ def diffusers_any(
     use_nchw_channels: bool = False,
     tiny_vae: str = None,
 ) -> BenchmarkResults:
-    # Some of these functionality might not be available in torch 2.1,
-    # but setting just in case if in the future we upgrade to a newer
-    # version of torch.
-    os.environ["TORCHINDUCTOR_CACHE_DIR"] = "/data/torch-cache"
-    os.environ["TORCHINDUCTOR_FX_GRAPH_CACHE"] = "1"
-
     import torch
-    from diffusers import AutoencoderTiny, DiffusionPipeline
+    from diffusers import AutoencoderTiny
+
+    from benchmarks.variants import pipeline_variant
+
+    # The base pipeline might have been loaded by a previous variant, in which
+    # case its original load times are reported (as the cold start of this
+    # variant) and only the delta below is actually applied.
+    pipeline, base_setup_timings = load_base_pipeline(model_name)
+    setup = StageTimer(enabled=True)
+    for stage, elapsed in base_setup_timings.items():
+        setup.record(stage, elapsed)
 
-    pipeline = DiffusionPipeline.from_pretrained(
-        model_name,
-        torch_dtype=torch.float16,
-        use_safetensors=True,
-    )
+    vae = None
     if tiny_vae:
-        pipeline.vae = AutoencoderTiny.from_pretrained(
-            tiny_vae,
-            torch_dtype=torch.float16,
-        )
+        with setup.stage(LOAD):
+            vae = AutoencoderTiny.from_pretrained(
+                tiny_vae,
+                torch_dtype=torch.float16,
+            )
 
-    pipeline.to("cuda")
+        with setup.stage(TO_DEVICE):
+            vae.to("cuda")
 
-    # Use XFormers memory efficient attention instead of Torch SDPA
-    # which might also utilize memory efficient attention (alongside
-    # flash attention).
-    if enable_xformers:
-        pipeline.enable_xformers_memory_efficient_attention()
+    cache = CompileCache()
+    with ExitStack() as variant:
+        # Compilation itself happens lazily, during the warmup, so the entry
+        # stays open until the benchmark is over.
+        if use_compile:
+            entry = variant.enter_context(
+                cache.open(
+                    "torch-inductor",
+                    torch.__version__,
+                    model_name,
+                    shape=(parameters.width, parameters.height, parameters.batch_size),
+                    options={
+                        "enable_xformers": enable_xformers,
+                        "use_nchw_channels": use_nchw_channels,
+                        "tiny_vae": tiny_vae,
+                    },
+                )
+            )
+            torch_compile_cache(entry)
 
-    if use_nchw_channels:
-        pipeline.unet = pipeline.unet.to(memory_format=torch.channels_last)
+        with setup.stage(COMPILE):
+            variant.enter_context(
+                pipeline_variant(
+                    pipeline,
+                    enable_xformers=enable_xformers,
+                    use_compile=use_compile,
+                    use_nchw_channels=use_nchw_channels,
+                    vae=vae,
+                )
+            )
 
-    # The mode here is reduce-overhead, which is a balanced compromise between
-    # compilation time and runtime. The other modes might be a possible choice
-    # for future benchmarks.
-    if use_compile:
-        pipeline.unet = torch.compile(
-            pipeline.unet, fullgraph=True, mode="reduce-overhead"
+        stages = instrument_diffusers_pipeline(pipeline)
+        steps = instrument_diffusers_steps(pipeline)
+        inference_func = partial(
+            pipeline,
+            parameters.prompt,
+            num_inference_steps=parameters.steps,
+            num_images_per_prompt=parameters.batch_size,
+            width=parameters.width,
+            height=parameters.height,
+            callback=steps.step,
+            callback_steps=1,
+        )
+        return benchmark_settings.apply(
+            inference_func,
+            stages=stages,
+            setup=setup,
+            steps=steps,
+            compile_cache=cache,
+            image_fn=seeded_image(inference_func),
         )
-
-    inference_func = partial(
-        pipeline, parameters.prompt, num_inference_steps=parameters.steps
-    )
-    return benchmark_settings.apply(inference_func)
 
 
-LOCAL_BENCHMARKS = [
-    {
-        "name": "Diffusers (torch 2.1, SDPA)",
-        "category": "SD1.5 (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_name": "runwayml/stable-diffusion-v1-5",
-        },
-    },
-    {
-        "name": r"Diffusers (torch 2.1, SDPA, [tiny VAE](https://github.com/madebyollin/taesd))\*",
-        "category": "SD1.5 (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_name": "runwayml/stable-diffusion-v1-5",
-            "tiny_vae": "madebyollin/taesd",
-        },
-    },
-    {
-        "name": "Diffusers (torch 2.1, xformers)",
-        "category": "SD1.5 (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_name": "runwayml/stable-diffusion-v1-5",
-            "enable_xformers": True,
-        },
-    },
-    {
-        "name": "Diffusers (torch 2.1, SDPA, compiled)",
-        "category": "SD1.5 (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_name": "runwayml/stable-diffusion-v1-5",
-            "use_compile": True,
-        },
+# Variants of the same model run back to back on the same worker (see
+# executors.group_key), reusing the base pipeline. The compiled ones come
+# last so that whatever compilation leaves behind can't affect the others.
+LOCAL_BENCHMARKS = BenchmarkMatrix(
+    backend="diffusers",
+    function=diffusers_any,
+    models={
+        "SD1.5": {"model_name": "runwayml/stable-diffusion-v1-5"},
+        "SDXL": {"model_name": "stabilityai/stable-diffusion-xl-base-1.0"},
     },
-    {
-        "name": "Diffusers (torch 2.1, SDPA, compiled, NCHW channels last)",
-        "category": "SD1.5 (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_name": "runwayml/stable-diffusion-v1-5",
-            "use_compile": True,
-            "use_nchw_channels": True,
-        },
+    options={
+        "attention": "sdpa",
+        "vae": "default",
+        "compile": False,
+        "channels_last": False,
     },
-    {
-        "name": "Diffusers (torch 2.1, SDPA)",
-        "category": "SDXL (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_name": "stabilityai/stable-diffusion-xl-base-1.0",
-        },
-    },
-    {
-        "name": r"Diffusers (torch 2.1, SDPA, [tiny VAE](https://github.com/madebyollin/taesd))\*",
-        "category": "SDXL (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_name": "stabilityai/stable-diffusion-xl-base-1.0",
-            "tiny_vae": "madebyollin/taesdxl",
-        },
-    },
-    {
-        "name": "Diffusers (torch 2.1, xformers)",
-        "category": "SDXL (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_name": "stabilityai/stable-diffusion-xl-base-1.0",
-            "enable_xformers": True,
-        },
-    },
-    {
-        "name": "Diffusers (torch 2.1, SDPA, compiled)",
-        "category": "SDXL (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_name": "stabilityai/stable-diffusion-xl-base-1.0",
-            "use_compile": True,
-        },
-    },
-    {
-        "name": "Diffusers (torch 2.1, SDPA, compiled, NCHW channels last)",
-        "category": "SDXL (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_name": "stabilityai/stable-diffusion-xl-base-1.0",
-            "use_compile": True,
-            "use_nchw_channels": True,
-        },
-    },
-]
+    variants=[
+        Variant("Diffusers (torch 2.1, SDPA)"),
+        Variant(
+            r"Diffusers (torch 2.1, SDPA, [tiny VAE](https://github.com/madebyollin/taesd))\*",
+            options={"vae": "tiny"},
+            model_kwargs={
+                "SD1.5": {"tiny_vae": "madebyollin/taesd"},
+                "SDXL": {"tiny_vae": "madebyollin/taesdxl"},
+            },
+        ),
+        Variant(
+            "Diffusers (torch 2.1, xformers)",
+            options={"attention": "xformers"},
+            kwargs={"enable_xformers": True},
+        ),
+        Variant(
+            "Diffusers (torch 2.1, SDPA, compiled)",
+            options={"compile": True},
+            kwargs={"use_compile": True},
+        ),
+        Variant(
+            "Diffusers (torch 2.1, SDPA, compiled, NCHW channels last)",
+            options={"compile": True, "channels_last": True},
+            kwargs={"use_compile": True, "use_nchw_channels": True},
+        ),
+    ],
+).expand()
@@ -4,6 +4,15 @@ from functools import partial
 
 import fal
 
+from benchmarks.images import seeded_image
+from benchmarks.instrumentation import (
+    LOAD,
+    TO_DEVICE,
+    StageTimer,
+    instrument_diffusers_pipeline,
+    instrument_diffusers_steps,
+)
+from benchmarks.matrix import BenchmarkMatrix, Variant
 from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParameters
 
 
@@ -15,6 +24,7 @@ from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParame
         "transformers==4.35.0",
         "xformers==0.0.22.post7",
         "git+https://github.com/openai/consistencydecoder.git@22a0449022f17a2d7bfc69535e8e8f3ff0585ecb",
+        "nvidia-ml-py",
     ],
     machine_type="GPU",
 )
@@ -38,26 +48,47 @@ def diffusers_consistency_decoder(
         def forward(self, *args, **kwargs):
             return self.decoder(*args, **kwargs)
 
-    pipeline = DiffusionPipeline.from_pretrained(
-        "runwayml/stable-diffusion-v1-5",
-        torch_dtype=torch.float16,
-        use_safetensors=True,
-    )
-    pipeline.vae.decoder = ConsistencyDecoderModule()
-    pipeline.to("cuda")
+    setup = StageTimer(enabled=True)
+    with setup.stage(LOAD):
+        pipeline = DiffusionPipeline.from_pretrained(
+            "runwayml/stable-diffusion-v1-5",
+            torch_dtype=torch.float16,
+            use_safetensors=True,
+        )
+        pipeline.vae.decoder = ConsistencyDecoderModule()
+
+    with setup.stage(TO_DEVICE):
+        pipeline.to("cuda")
+    stages = instrument_diffusers_pipeline(pipeline)
+    steps = instrument_diffusers_steps(pipeline)
 
     inference_func = partial(
         pipeline,
         parameters.prompt,
         num_inference_steps=parameters.steps,
+        num_images_per_prompt=parameters.batch_size,
+        width=parameters.width,
+        height=parameters.height,
+        callback=steps.step,
+        callback_steps=1,
+    )
+    return benchmark_settings.apply(
+        inference_func,
+        stages=stages,
+        setup=setup,
+        steps=steps,
+        image_fn=seeded_image(inference_func),
     )
-    return benchmark_settings.apply(inference_func)
 
 
-LOCAL_BENCHMARKS = [
-    {
-        "name": r"Diffusers (torch 2.1, SDPA) + OpenAI's [consistency decoder](https://github.com/openai/consistencydecoder)\*\*",
-        "category": "SD1.5 (End-to-end)",
-        "function": diffusers_consistency_decoder,
-    },
-]
+LOCAL_BENCHMARKS = BenchmarkMatrix(
+    backend="diffusers",
+    function=diffusers_consistency_decoder,
+    models={"SD1.5": {}},
+    options={"attention": "sdpa", "vae": "consistency", "compile": False},
+    variants=[
+        Variant(
+            r"Diffusers (torch 2.1, SDPA) + OpenAI's [consistency decoder](https://github.com/openai/consistencydecoder)\*\*"
+        ),
+    ],
+).expand()
@@ -6,6 +6,15 @@ from urllib.request import urlretrieve
 
 import fal
 
+from benchmarks.images import seeded_image
+from benchmarks.instrumentation import (
+    LOAD,
+    TO_DEVICE,
+    StageTimer,
+    instrument_diffusers_pipeline,
+    instrument_diffusers_steps,
+)
+from benchmarks.matrix import BenchmarkMatrix, Variant
 from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParameters
 
 
@@ -17,6 +26,7 @@ from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParame
         "transformers==4.35.0",
         "xformers==0.0.22.post7",
         "https://github.com/Dao-AILab/flash-attention/releases/download/v2.3.3/flash_attn-2.3.3+cu122torch2.1cxx11abiFALSE-cp311-cp311-linux_x86_64.whl",
+        "nvidia-ml-py",
     ],
     machine_type="GPU",
 )
@@ -35,48 +45,70 @@ def diffusers_any(
     class UnetRewriteModel(sdxl_rewrite["UNet2DConditionModel"], ModelMixin):  # type: ignore
         pass
 
-    pipeline = StableDiffusionXLPipeline.from_pretrained(
-        "stabilityai/stable-diffusion-xl-base-1.0",
-        torch_dtype=torch.float16,
-        use_safetensors=True,
-    )
-    pipeline = pipeline.to("cuda")
+    setup = StageTimer(enabled=True)
+    with setup.stage(LOAD):
+        pipeline = StableDiffusionXLPipeline.from_pretrained(
+            "stabilityai/stable-diffusion-xl-base-1.0",
+            torch_dtype=torch.float16,
+            use_safetensors=True,
+        )
+
+    with setup.stage(TO_DEVICE):
+        pipeline = pipeline.to("cuda")
 
-    with torch.device("cuda"):
+    # The rewritten UNet is initialized directly on the device, from the
+    # weights of the original one.
+    with setup.stage(LOAD), torch.device("cuda"):
         with torch.cuda.amp.autocast():
             unet_new = UnetRewriteModel().half()
             unet_new.load_state_dict(pipeline.unet.state_dict())
 
     pipeline.unet = unet_new.eval()
+    stages = instrument_diffusers_pipeline(pipeline)
+    steps = instrument_diffusers_steps(pipeline)
     inference_func = partial(
-        pipeline, parameters.prompt, num_inference_steps=parameters.steps
+        pipeline,
+        parameters.prompt,
+        num_inference_steps=parameters.steps,
+        num_images_per_prompt=parameters.batch_size,
+        width=parameters.width,
+        height=parameters.height,
+        callback=steps.step,
+        callback_steps=1,
+    )
+    return benchmark_settings.apply(
+        inference_func,
+        stages=stages,
+        setup=setup,
+        steps=steps,
+        image_fn=seeded_image(inference_func),
     )
-    return benchmark_settings.apply(inference_func)
 
 
-LOCAL_BENCHMARKS = [
-    {
-        "name": "[minSDXL](https://github.com/cloneofsimo/minSDXL) (torch 2.1)",
-        "category": "SDXL (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_url": "https://raw.githubusercontent.com/cloneofsimo/minSDXL/504838853cde2736d9d766ec55abe9b481ac7988/sdxl_rewrite.py",
-        },
-    },
-    {
-        "name": "[minSDXL+](https://github.com/isidentical/minSDXL) (torch 2.1, SDPA)",
-        "category": "SDXL (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_url": "https://raw.githubusercontent.com/isidentical/minSDXL/4e378780c75399823aa29404b9e1288d96c22943/sdxl_rewrite.py",
-        },
-    },
-    {
-        "name": "[minSDXL+](https://github.com/isidentical/minSDXL) (torch 2.1, flash-attention v2)",
-        "category": "SDXL (End-to-end)",
-        "function": diffusers_any,
-        "kwargs": {
-            "model_url": "https://raw.githubusercontent.com/isidentical/minSDXL/0fd7fe9c6f6544f7d16eb7a41cd7606cddb9527c/sdxl_rewrite.py",
-        },
-    },
-]
+LOCAL_BENCHMARKS = BenchmarkMatrix(
+    backend="minsdxl",
+    function=diffusers_any,
+    models={"SDXL": {}},
+    options={"attention": "sdpa", "compile": False},
+    variants=[
+        Variant(
+            "[minSDXL](https://github.com/cloneofsimo/minSDXL) (torch 2.1)",
+            kwargs={
+                "model_url": "https://raw.githubusercontent.com/cloneofsimo/minSDXL/504838853cde2736d9d766ec55abe9b481ac7988/sdxl_rewrite.py",
+            },
+        ),
+        Variant(
+            "[minSDXL+](https://github.com/isidentical/minSDXL) (torch 2.1, SDPA)",
+            kwargs={
+                "model_url": "https://raw.githubusercontent.com/isidentical/minSDXL/4e378780c75399823aa29404b9e1288d96c22943/sdxl_rewrite.py",
+            },
+        ),
+        Variant(
+            "[minSDXL+](https://github.com/isidentical/minSDXL) (torch 2.1, flash-attention v2)",
+            options={"attention": "flash-attention"},
+            kwargs={
+                "model_url": "https://raw.githubusercontent.com/isidentical/minSDXL/0fd7fe9c6f6544f7d16eb7a41cd7606cddb9527c/sdxl_rewrite.py",
+            },
+        ),
+    ],
+).expand()
@@ -1,9 +1,18 @@
 from __future__ import annotations
 
-from functools import partial
-
 import fal
 
+from benchmarks.compile_cache import CompileCache
+from benchmarks.images import seeded_image
+from benchmarks.instrumentation import (
+    COMPILE,
+    LOAD,
+    TO_DEVICE,
+    StageTimer,
+    instrument_diffusers_pipeline,
+    instrument_diffusers_steps,
+)
+from benchmarks.matrix import BenchmarkMatrix, Variant
 from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParameters
 
 
@@ -17,6 +26,7 @@ from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParame
         "oneflow",
         "-f",
         "https://oneflow-pro.oss-cn-beijing.aliyuncs.com/branch/community/cu121",
+        "nvidia-ml-py",
     ],
     machine_type="GPU",
 )
@@ -30,36 +40,71 @@ def oneflow_any(
     from diffusers import DiffusionPipeline
     from onediff.infer_compiler import oneflow_compile
 
-    pipeline = DiffusionPipeline.from_pretrained(
+    setup = StageTimer(enabled=True)
+    with setup.stage(LOAD):
+        pipeline = DiffusionPipeline.from_pretrained(
+            model_name,
+            torch_dtype=torch.float16,
+            use_safetensors=True,
+        )
+
+    with setup.stage(TO_DEVICE):
+        pipeline.to("cuda")
+
+    # The compiled UNet graph is saved after the first run and loaded back
+    # (rather than compiled again) on the next ones.
+    cache = CompileCache()
+    with cache.open(
+        "oneflow",
+        flow.__version__,
         model_name,
-        torch_dtype=torch.float16,
-        use_safetensors=True,
-    )
-    pipeline.to("cuda")
-    pipeline.unet = oneflow_compile(pipeline.unet)
+        shape=(parameters.width, parameters.height, parameters.batch_size),
+    ) as entry:
+        graph_file = entry.path / "unet.graph"
+        with setup.stage(COMPILE):
+            pipeline.unet = oneflow_compile(pipeline.unet)
+            if entry.hit:
+                pipeline.unet.load_graph(str(graph_file), torch.device("cuda"))
+        stages = instrument_diffusers_pipeline(pipeline)
+        steps = instrument_diffusers_steps(pipeline)
+
+        # Autocast is thread-local, so it is entered on each call rather than
+        # around the whole benchmark (the load test serves requests from its
+        # own threads).
+        def infer_func(**kwargs):
+            with flow.autocast("cuda"):
+                return pipeline(
+                    parameters.prompt,
+                    num_inference_steps=parameters.steps,
+                    num_images_per_prompt=parameters.batch_size,
+                    width=parameters.width,
+                    height=parameters.height,
+                    callback=steps.step,
+                    callback_steps=1,
+                    **kwargs,
+                )
 
-    with flow.autocast("cuda"):
-        infer_func = partial(
-            pipeline, parameters.prompt, num_inference_steps=parameters.steps
+        results = benchmark_settings.apply(
+            infer_func,
+            stages=stages,
+            setup=setup,
+            steps=steps,
+            compile_cache=cache,
+            image_fn=seeded_image(infer_func),
         )
-        return benchmark_settings.apply(infer_func)
+        if not entry.hit:
+            pipeline.unet.save_graph(str(graph_file))
 
+    return results
 
-LOCAL_BENCHMARKS = [
-    {
-        "name": "OneFlow",
-        "category": "SD1.5 (End-to-end)",
-        "function": oneflow_any,
-        "kwargs": {
-            "model_name": "runwayml/stable-diffusion-v1-5",
-        },
-    },
-    {
-        "name": "OneFlow",
-        "category": "SDXL (End-to-end)",
-        "function": oneflow_any,
-        "kwargs": {
-            "model_name": "stabilityai/stable-diffusion-xl-base-1.0",
-        },
+
+LOCAL_BENCHMARKS = BenchmarkMatrix(
+    backend="oneflow",
+    function=oneflow_any,
+    models={
+        "SD1.5": {"model_name": "runwayml/stable-diffusion-v1-5"},
+        "SDXL": {"model_name": "stabilityai/stable-diffusion-xl-base-1.0"},
     },
-]
+    options={"compile": True},
+    variants=[Variant("OneFlow")],
+).expand()
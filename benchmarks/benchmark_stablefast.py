@@ -1,9 +1,21 @@
 from __future__ import annotations
 
 from functools import partial
+from importlib.metadata import version
 
 import fal
 
+from benchmarks.compile_cache import CompileCache, triton_cache
+from benchmarks.images import seeded_image
+from benchmarks.instrumentation import (
+    COMPILE,
+    LOAD,
+    TO_DEVICE,
+    StageTimer,
+    instrument_diffusers_pipeline,
+    instrument_diffusers_steps,
+)
+from benchmarks.matrix import BenchmarkMatrix, Variant
 from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParameters
 
 
@@ -18,6 +30,7 @@ from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParame
         "https://github.com/chengzeyi/stable-fast/releases/download/v1.0.0/stable_fast-1.0.0+torch211cu121-cp311-cp311-manylinux2014_x86_64.whl",
         "--extra-index-url",
         "https://download.pytorch.org/whl/cu121",
+        "nvidia-ml-py",
     ],
     machine_type="GPU",
 )
@@ -30,40 +43,63 @@ def stablefast_any(
     from diffusers import DiffusionPipeline
     from sfast.compilers.diffusion_pipeline_compiler import CompilationConfig, compile
 
-    pipeline = DiffusionPipeline.from_pretrained(
-        model_name,
-        torch_dtype=torch.float16,
-        use_safetensors=True,
-    )
-    pipeline.to("cuda")
+    setup = StageTimer(enabled=True)
+    with setup.stage(LOAD):
+        pipeline = DiffusionPipeline.from_pretrained(
+            model_name,
+            torch_dtype=torch.float16,
+            use_safetensors=True,
+        )
 
-    config = CompilationConfig.Default()
-    config.enable_xformers = True
-    config.enable_triton = True
-    config.enable_cuda_graph = True
-    pipeline = compile(pipeline, config)
+    with setup.stage(TO_DEVICE):
+        pipeline.to("cuda")
 
-    inference_func = partial(
-        pipeline, parameters.prompt, num_inference_steps=parameters.steps
-    )
-    return benchmark_settings.apply(inference_func)
+    # Stable Fast traces the pipeline again on every start (and captures its
+    # CUDA graphs), only the triton kernels it generates can be cached.
+    cache = CompileCache()
+    with cache.open(
+        "stable-fast",
+        version("stable-fast"),
+        model_name,
+        shape=(parameters.width, parameters.height, parameters.batch_size),
+    ) as entry:
+        triton_cache(entry)
+        with setup.stage(COMPILE):
+            config = CompilationConfig.Default()
+            config.enable_xformers = True
+            config.enable_triton = True
+            config.enable_cuda_graph = True
+            pipeline = compile(pipeline, config)
 
+        stages = instrument_diffusers_pipeline(pipeline)
+        steps = instrument_diffusers_steps(pipeline)
+        inference_func = partial(
+            pipeline,
+            parameters.prompt,
+            num_inference_steps=parameters.steps,
+            num_images_per_prompt=parameters.batch_size,
+            width=parameters.width,
+            height=parameters.height,
+            callback=steps.step,
+            callback_steps=1,
+        )
+        return benchmark_settings.apply(
+            inference_func,
+            stages=stages,
+            setup=setup,
+            steps=steps,
+            compile_cache=cache,
+            image_fn=seeded_image(inference_func),
+        )
 
-LOCAL_BENCHMARKS = [
-    {
-        "name": "Stable Fast (torch 2.1)",
-        "category": "SD1.5 (End-to-end)",
-        "function": stablefast_any,
-        "kwargs": {
-            "model_name": "runwayml/stable-diffusion-v1-5",
-        },
-    },
-    {
-        "name": "Stable Fast (torch 2.1)",
-        "category": "SDXL (End-to-end)",
-        "function": stablefast_any,
-        "kwargs": {
-            "model_name": "stabilityai/stable-diffusion-xl-base-1.0",
-        },
+
+LOCAL_BENCHMARKS = BenchmarkMatrix(
+    backend="stable-fast",
+    function=stablefast_any,
+    models={
+        "SD1.5": {"model_name": "runwayml/stable-diffusion-v1-5"},
+        "SDXL": {"model_name": "stabilityai/stable-diffusion-xl-base-1.0"},
     },
-]
+    options={"attention": "xformers", "compile": True},
+    variants=[Variant("Stable Fast (torch 2.1)")],
+).expand()
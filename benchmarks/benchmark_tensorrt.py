@@ -9,11 +9,27 @@ from pathlib import Path
 
 import fal
 
+from benchmarks.compile_cache import CompileCache
+from benchmarks.instrumentation import (
+    COMPILE,
+    LOAD,
+    TEXT_ENCODER,
+    TO_DEVICE,
+    UNET,
+    VAE_DECODE,
+    StageTimer,
+)
+from benchmarks.matrix import BenchmarkMatrix, Variant
 from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParameters
 
 DATA_DIR = Path("/data/tensorrt")
 REPO_DIR = DATA_DIR / "repo"
 
+NATIVE_RESOLUTIONS = {
+    "1.5": 512,
+    "xl-1.0": 1024,
+}
+
 
 def prepare_tensorrt() -> Path:
     DATA_DIR.mkdir(exist_ok=True)
@@ -63,6 +79,7 @@ def prepare_tensorrt() -> Path:
         "https://pypi.nvidia.com",
         "--extra-index-url",
         "https://pypi.ngc.nvidia.com",
+        "nvidia-ml-py",
     ],
     machine_type="GPU",
 )
@@ -70,17 +87,22 @@ def tensorrt_any(
     benchmark_settings: BenchmarkSettings,
     parameters: InputParameters,
     model_version: str,
-    image_height: int,
-    image_width: int,
 ) -> BenchmarkResults:
+    import tensorrt
     import torch
 
-    trt_path = prepare_tensorrt()
+    image_height = parameters.height or NATIVE_RESOLUTIONS[model_version]
+    image_width = parameters.width or NATIVE_RESOLUTIONS[model_version]
+
+    setup = StageTimer(enabled=True)
+    with setup.stage(LOAD):
+        trt_path = prepare_tensorrt()
     diffusion_dir = trt_path / "demo" / "Diffusion"
     if str(diffusion_dir) not in sys.path:
         sys.path.insert(0, str(diffusion_dir))
 
-    with contextlib.chdir(diffusion_dir):
+    cache = CompileCache()
+    with contextlib.chdir(diffusion_dir), contextlib.ExitStack() as cached:
         from cuda import cudart
         from stable_diffusion_pipeline import StableDiffusionPipeline
         from utilities import PIPELINE_TYPE
@@ -90,7 +112,7 @@ def tensorrt_any(
             "version": model_version,
             "denoising_steps": parameters.steps,
             "use_cuda_graph": True,
-            "max_batch_size": 4,
+            "max_batch_size": max(4, parameters.batch_size),
             "output_dir": "output",
         }
 
@@ -102,62 +124,83 @@ def tensorrt_any(
         else:
             raise ValueError(f"Unknown model version: {model_version}")
 
-        pipeline = StableDiffusionPipeline(**options)
-        pipeline.loadEngines(
-            engine_dir=f"engine-{model_version}-{torch.cuda.get_device_name(0)}",
-            framework_model_dir="pytorch_model",
-            onnx_dir=f"onnx-{model_version}",
-            onnx_opset=18,
-            opt_batch_size=1,
-            opt_image_height=image_height,
-            opt_image_width=image_width,
-            enable_all_tactics=False,
-            enable_refit=False,
-            force_build=False,
-            force_export=False,
-            force_optimize=False,
-            static_batch=True,
-            static_shape=True,
-            timing_cache=f"cache-{model_version}-{torch.cuda.get_device_name(0)}",
+        with setup.stage(LOAD):
+            pipeline = StableDiffusionPipeline(**options)
+
+        # The ONNX export is the same for all shapes, but the engines are
+        # built with static shapes so they can't be shared between different
+        # batch sizes or resolutions.
+        onnx = cached.enter_context(
+            cache.open("onnx", torch.__version__, model_version)
         )
+        engines = cached.enter_context(
+            cache.open(
+                "tensorrt",
+                tensorrt.__version__,
+                model_version,
+                shape=(image_width, image_height, parameters.batch_size),
+            )
+        )
+
+        # Exports the ONNX models and builds the engines, unless they are
+        # already in the compile cache.
+        with setup.stage(COMPILE):
+            pipeline.loadEngines(
+                engine_dir=str(engines.path / "engine"),
+                framework_model_dir="pytorch_model",
+                onnx_dir=str(onnx.path),
+                onnx_opset=18,
+                opt_batch_size=parameters.batch_size,
+                opt_image_height=image_height,
+                opt_image_width=image_width,
+                enable_all_tactics=False,
+                enable_refit=False,
+                force_build=False,
+                force_export=False,
+                force_optimize=False,
+                static_batch=True,
+                static_shape=True,
+                timing_cache=str(engines.path / "timing-cache"),
+            )
 
         # Load resources
-        _, shared_device_memory = cudart.cudaMalloc(pipeline.calculateMaxDeviceMemory())
-        pipeline.activateEngines(shared_device_memory)
-        pipeline.loadResources(image_height, image_width, 1, seed=0)
+        with setup.stage(TO_DEVICE):
+            _, shared_device_memory = cudart.cudaMalloc(
+                pipeline.calculateMaxDeviceMemory()
+            )
+            pipeline.activateEngines(shared_device_memory)
+            pipeline.loadResources(
+                image_height, image_width, parameters.batch_size, seed=0
+            )
+
+        stages = StageTimer(synchronize=torch.cuda.synchronize)
+        stages.wrap(pipeline, "encode_prompt", TEXT_ENCODER)
+        stages.wrap(pipeline, "denoise_latent", UNET)
+        stages.wrap(pipeline, "decode_latent", VAE_DECODE)
+
         inference_func = partial(
             pipeline.infer,
-            [parameters.prompt],
-            [""],
+            [parameters.prompt] * parameters.batch_size,
+            [""] * parameters.batch_size,
             image_height=image_height,
             image_width=image_width,
             save_image=False,
         )
-        results = benchmark_settings.apply(inference_func)
+        results = benchmark_settings.apply(
+            inference_func, stages=stages, setup=setup, compile_cache=cache
+        )
         pipeline.teardown()
 
     return results
 
 
-LOCAL_BENCHMARKS = [
-    {
-        "name": "TensorRT 9.0 (cuda graphs, static shapes)",
-        "category": "SD1.5 (End-to-end)",
-        "function": tensorrt_any,
-        "kwargs": {
-            "model_version": "1.5",
-            "image_height": 512,
-            "image_width": 512,
-        },
-    },
-    {
-        "name": "TensorRT 9.0 (cuda graphs, static shapes)",
-        "category": "SDXL (End-to-end)",
-        "function": tensorrt_any,
-        "kwargs": {
-            "model_version": "xl-1.0",
-            "image_height": 512,
-            "image_width": 512,
-        },
+LOCAL_BENCHMARKS = BenchmarkMatrix(
+    backend="tensorrt",
+    function=tensorrt_any,
+    models={
+        "SD1.5": {"model_version": "1.5"},
+        "SDXL": {"model_version": "xl-1.0"},
     },
-]
+    options={"compile": True},
+    variants=[Variant("TensorRT 9.0 (cuda graphs, static shapes)")],
+).expand()
@@ -1,37 +1,145 @@
+from __future__ import annotations
+
 import json
 import statistics
 from argparse import ArgumentParser
 from collections import defaultdict
+from dataclasses import dataclass
 from pathlib import Path
 
 from rich.console import Console
+from rich.markup import escape
 from rich.table import Table
 
+from benchmarks.memory import HOST_PEAK_RSS, PEAK_RESERVED
+from benchmarks.session import base_failures, base_results
+from benchmarks.stats import bootstrap_median_interval, mann_whitney_u
+
 README_PATH = Path(__file__).parent.parent / "README.md"
 
 
+@dataclass
+class Comparison:
+    median: float
+    interval: tuple[float, float]
+
+    # Against the baseline session (None for the baseline itself).
+    change: float | None = None
+    p_value: float | None = None
+
+    def is_significant(self, alpha: float) -> bool:
+        return self.p_value is not None and self.p_value < alpha
+
+
+def compare(
+    timings: list[float],
+    baseline_timings: list[float] | None,
+    confidence: float,
+) -> Comparison:
+    median = statistics.median(timings)
+    comparison = Comparison(
+        median=median,
+        interval=bootstrap_median_interval(timings, confidence),
+    )
+    if baseline_timings is not None:
+        baseline_median = statistics.median(baseline_timings)
+        comparison.change = (median - baseline_median) / baseline_median
+        comparison.p_value = mann_whitney_u(timings, baseline_timings)
+    return comparison
+
+
+def format_comparison(comparison: Comparison, alpha: float, best: bool) -> str:
+    low, high = comparison.interval
+    median = f"{comparison.median:.2f}s"
+    if best:
+        median = f"[bold][green]{median}[/green][/bold]"
+
+    cell = f"{median} [{low:.2f}, {high:.2f}]"
+    if comparison.change is not None:
+        change = f"{comparison.change:+.1%}"
+        if comparison.is_significant(alpha):
+            color = "red" if comparison.change > 0 else "green"
+            change = f"[{color}]{change}*[/{color}]"
+        cell += f" {change}"
+    return cell
+
+
+def format_peak_memory(memory: dict) -> str:
+    if (peak := memory.get(PEAK_RESERVED)) is not None:
+        return f"{peak / 2**30:.2f}"
+    # Without CUDA, only the host memory is available, which can't be
+    # compared with the device's.
+    if (peak := memory.get(HOST_PEAK_RSS)) is not None:
+        return f"{peak / 2**30:.2f} (host RSS)"
+    return "N/A"
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument("results_files", type=Path, nargs="+")
+    parser.add_argument(
+        "--baseline",
+        help="Name (file stem) of the session the others are compared against. "
+        "Defaults to the first one.",
+    )
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument(
+        "--alpha",
+        type=float,
+        default=0.05,
+        help="Significance level of the Mann-Whitney U test; changes are "
+        "marked with a * below it.",
+    )
+    parser.add_argument(
+        "--fail-on-regression",
+        type=float,
+        metavar="THRESHOLD",
+        default=None,
+        help="Exit with a non-zero status when any benchmark is significantly "
+        "slower than in the baseline by more than this fraction (e.g. 0.05 for "
+        "5%%), or fails where the baseline succeeded.",
+    )
 
     options = parser.parse_args()
     results = {
         result_file.stem: json.loads(result_file.read_text())
         for result_file in options.results_files
     }
+    baseline_name = options.baseline or next(iter(results))
+    if baseline_name not in results:
+        parser.error(f"Unknown baseline session: {baseline_name}")
 
     benchmarks = defaultdict(dict)
+    failures = defaultdict(dict)
     for result_name, result_values in results.items():
-        for timing in result_values["timings"]:
-            benchmarks[(timing["category"], timing["name"])][result_name] = timing[
-                "timings"
-            ]
+        for timing in base_results(result_values):
+            benchmarks[(timing["category"], timing["name"])][result_name] = timing
+        for failure in base_failures(result_values):
+            failures[(failure["category"], failure["name"])][result_name] = failure
+            # Benchmarks that failed in all sessions still get a row.
+            benchmarks.setdefault((failure["category"], failure["name"]), {})
 
+    # Memory columns are only shown if at least one of the sessions has
+    # collected them.
+    show_memory = any(
+        timing.get("memory")
+        for benchmark_results in benchmarks.values()
+        for timing in benchmark_results.values()
+    )
+
+    regressions = []
     with Console() as console:
-        table = Table()
+        table = Table(
+            caption=f"Median [{options.confidence:.0%} CI], change vs "
+            f"{baseline_name} (* p < {options.alpha})"
+        )
         table.add_column("Benchmark")
         for result_name in results.keys():
             table.add_column(" ".join(map(str.title, result_name.split("-"))))
+        if show_memory:
+            for result_name in results.keys():
+                title = " ".join(map(str.title, result_name.split("-")))
+                table.add_column(f"{title} (peak reserved GiB)")
 
         for benchmark_key, benchmark_results in sorted(
             benchmarks.items(),
@@ -40,33 +148,78 @@ def main():
             if "CPU" in benchmark_key[0]:
                 continue
 
-            row = [f"{benchmark_key[0].split(' ')[0]:5} {benchmark_key[1]}"]
-            raw_values = []
+            benchmark_name = f"{benchmark_key[0].split(' ')[0]:5} {benchmark_key[1]}"
+            row = [benchmark_name]
+            baseline = benchmark_results.get(baseline_name)
+            comparisons = {}
             for result_name in results.keys():
                 if result_name in benchmark_results:
-                    raw_values.append(
+                    comparisons[result_name] = compare(
+                        benchmark_results[result_name]["timings"],
                         (
-                            statistics.mean(benchmark_results[result_name]),
-                            statistics.stdev(benchmark_results[result_name]),
-                        )
+                            baseline["timings"]
+                            if baseline is not None and result_name != baseline_name
+                            else None
+                        ),
+                        options.confidence,
                     )
-                else:
-                    raw_values.append((float("nan"), float("nan")))
 
             # Bold the best result
-            best_index = raw_values.index(min(raw_values))
-            for i, (mean, std) in enumerate(raw_values):
-                if i == best_index:
-                    row.append(f"[bold][green]{mean:.2f}s[/green][/bold] ± {std:.2f}s")
-                elif mean is not float("nan"):
-                    row.append(f"{mean:.2f}s ± {std:.2f}s")
+            best_name = min(
+                comparisons,
+                key=lambda name: comparisons[name].median,
+                default=None,
+            )
+            for result_name in results.keys():
+                if comparison := comparisons.get(result_name):
+                    row.append(
+                        format_comparison(
+                            comparison,
+                            options.alpha,
+                            best=result_name == best_name,
+                        )
+                    )
+                    if (
+                        options.fail_on_regression is not None
+                        and comparison.change is not None
+                        and comparison.change > options.fail_on_regression
+                        and comparison.is_significant(options.alpha)
+                    ):
+                        regressions.append(
+                            f"{benchmark_name} ({result_name}): "
+                            f"{comparison.change:+.1%}, p={comparison.p_value:.3f}"
+                        )
+                elif failure := failures[benchmark_key].get(result_name):
+                    error_type = failure["error"]["type"].rsplit(".", 1)[-1]
+                    row.append(f"[red]failed[/red] ({error_type})")
+                    if options.fail_on_regression is not None and baseline:
+                        regressions.append(
+                            f"{benchmark_name} ({result_name}): failed with "
+                            f"{error_type}"
+                        )
                 else:
-                    row.append("N/A")
+                    row.append("[yellow]missing[/yellow]")
+
+            if show_memory:
+                for result_name in results.keys():
+                    memory = benchmark_results.get(result_name, {}).get("memory") or {}
+                    row.append(format_peak_memory(memory))
 
             table.add_row(*row)
 
         console.print(table)
 
+        if regressions:
+            console.print(
+                f"[red]{len(regressions)} regression(s) beyond "
+                f"{options.fail_on_regression:.0%} against {baseline_name}:[/red]"
+            )
+            for regression in regressions:
+                console.print(f"  {escape(regression)}")
+
+    if regressions:
+        raise SystemExit(1)
+
 
 if __name__ == "__main__":
     main()
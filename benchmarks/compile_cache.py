@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+# Shared by all the backends, on the persistent volume of the workers.
+CACHE_ROOT = Path("/data/compile-cache")
+
+# Least recently used entries are evicted past this size (in bytes).
+MAX_CACHE_SIZE = 200 * 2**30
+
+COMPLETE_MARKER = ".complete"
+LOCK_FILE = ".lock"
+METADATA_FILE = "metadata.json"
+
+
+@dataclass
+class CacheKey:
+    backend: str
+    version: str
+    model: str
+    gpu: str
+
+    # Only for the backends that compile for static shapes, e.g. as
+    # (width, height, batch size).
+    shape: tuple[int | None, ...] | None = None
+
+    # Anything else the artifacts depend on (e.g. the variant of a model).
+    options: dict[str, Any] = field(default_factory=dict)
+
+    def digest(self) -> str:
+        return hashlib.sha256(
+            json.dumps(asdict(self), sort_keys=True).encode()
+        ).hexdigest()[:16]
+
+
+@dataclass
+class CacheEntry:
+    key: CacheKey
+    path: Path
+
+    # Whether the artifacts were already there when the entry was opened.
+    hit: bool = False
+
+    def report(self) -> dict[str, Any]:
+        return {**asdict(self.key), "hit": self.hit}
+
+
+@dataclass
+class CompileCache:
+    """Directory per (backend, version, model, GPU, shape) on the /data volume
+    for the backends to keep their compiled artifacts in (engines, kernels,
+    graphs), with the least recently used ones evicted past max_size.
+
+    An entry only counts as a hit once a previous run committed it, i.e. made
+    it through the compilation; anything left by an interrupted one is
+    cleared first so backends never pick up partial artifacts.
+    """
+
+    root: Path = CACHE_ROOT
+    max_size: int = MAX_CACHE_SIZE
+    entries: list[CacheEntry] = field(default_factory=list)
+
+    @contextmanager
+    def open(
+        self,
+        backend: str,
+        version: str,
+        model: str,
+        shape: tuple[int | None, ...] | None = None,
+        options: dict[str, Any] | None = None,
+        gpu: str | None = None,
+    ) -> Iterator[CacheEntry]:
+        """Open the entry for the given key for the duration of the block,
+        and commit it if the block succeeds.
+        """
+        if gpu is None:
+            import torch
+
+            gpu = torch.cuda.get_device_name()
+
+        key = CacheKey(backend, version, model, gpu, shape, options or {})
+        path = self.root / backend / key.digest()
+        path.mkdir(parents=True, exist_ok=True)
+
+        # Held (shared) while the entry is in use, so that the eviction from
+        # other workers on the same volume leaves it alone.
+        with open(path / LOCK_FILE, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            entry = CacheEntry(key, path, hit=(path / COMPLETE_MARKER).exists())
+            if not entry.hit:
+                for child in path.iterdir():
+                    if child.name != LOCK_FILE:
+                        remove(child)
+
+            (path / METADATA_FILE).write_text(json.dumps(asdict(key)))
+            self.entries.append(entry)
+            yield entry
+            (path / COMPLETE_MARKER).touch()
+
+        self.evict()
+
+    def evict(self) -> None:
+        # Recency is the modification time of the complete marker, which is
+        # touched on every use.
+        entries = sorted(
+            (
+                ((entry / COMPLETE_MARKER).stat().st_mtime, entry)
+                if (entry / COMPLETE_MARKER).exists()
+                else (0.0, entry)
+                for backend in self.root.iterdir()
+                if backend.is_dir()
+                for entry in backend.iterdir()
+                if entry.is_dir()
+            ),
+            key=lambda item: item[0],
+        )
+        sizes = {entry: directory_size(entry) for _, entry in entries}
+        total = sum(sizes.values())
+        for _, entry in entries:
+            if total <= self.max_size:
+                break
+
+            with open(entry / LOCK_FILE, "w") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # In use by another worker.
+                    continue
+
+                print(f"Evicting {entry} from the compile cache")
+                for child in entry.iterdir():
+                    if child.name != LOCK_FILE:
+                        remove(child)
+                total -= sizes[entry]
+
+    def report(self) -> dict[str, Any] | None:
+        """Whether the startup was a cache hit (every entry it used was), or
+        None for the backends that don't compile anything.
+        """
+        if not self.entries:
+            return None
+
+        return {
+            "hit": all(entry.hit for entry in self.entries),
+            "entries": [entry.report() for entry in self.entries],
+        }
+
+
+def remove(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink()
+
+
+def directory_size(path: Path) -> int:
+    return sum(
+        os.path.getsize(os.path.join(directory, file_name))
+        for directory, _, file_names in os.walk(path)
+        for file_name in file_names
+    )
+
+
+def triton_cache(entry: CacheEntry) -> None:
+    """Point triton's kernel cache at the given entry."""
+    os.environ["TRITON_CACHE_DIR"] = str(entry.path / "triton")
+
+
+def torch_compile_cache(entry: CacheEntry) -> None:
+    """Point inductor's (and triton's) caches at the given entry."""
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = str(entry.path / "inductor")
+    os.environ["TORCHINDUCTOR_FX_GRAPH_CACHE"] = "1"
+    triton_cache(entry)
+
+    # Inductor memoizes its cache directory the first time it is used, which
+    # might have been for another entry on a warm worker.
+    from torch._inductor import codecache
+
+    if hasattr(codecache.cache_dir, "cache_clear"):
+        codecache.cache_dir.cache_clear()
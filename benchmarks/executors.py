@@ -0,0 +1,313 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import pickle
+import shutil
+import subprocess
+import threading
+import venv
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import Any
+
+from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParameters
+
+PROJECT_DIR = Path(__file__).parent.parent
+DEFAULT_VENVS_DIR = Path.home() / ".cache" / "stable-diffusion-benchmarks" / "venvs"
+
+
+def unwrap(function: Any) -> Callable[..., BenchmarkResults]:
+    """Return the plain Python function behind a fal isolated function (or
+    the function itself, for benchmarks that are not wrapped by fal).
+    """
+    for attribute in ("raw_func", "func"):
+        if callable(raw_func := getattr(function, attribute, None)):
+            return raw_func
+    return function
+
+
+def get_requirements(benchmark: dict) -> list[str]:
+    if "requirements" in benchmark:
+        return benchmark["requirements"]
+
+    options = getattr(benchmark["function"], "options", None)
+    environment = getattr(options, "environment", None) or {}
+    return environment.get("requirements", [])
+
+
+def group_key(benchmark: dict) -> tuple[str, ...]:
+    # Benchmarks that call the same function in the same environment can
+    # share a worker, and only the first of them pays for its cold start.
+    function = unwrap(benchmark["function"])
+    return (function.__module__, function.__qualname__, *get_requirements(benchmark))
+
+
+Job = tuple[dict, BenchmarkSettings, InputParameters]
+
+
+class Executor(ABC):
+    """Runs a single benchmark somewhere and returns its results."""
+
+    @abstractmethod
+    def run(
+        self,
+        benchmark: dict,
+        settings: BenchmarkSettings,
+        parameters: InputParameters,
+        fresh: bool = False,
+    ) -> BenchmarkResults:
+        ...
+
+    def run_group(
+        self,
+        jobs: list[Job],
+        gpu: int | None = None,
+        fresh: bool = False,
+    ) -> Iterator[BenchmarkResults | Exception]:
+        """Run benchmarks that share a group_key one after the other, on the
+        same (warm) worker when the executor supports it. Yields the results
+        (or the exception) of each job, in order, as soon as they are ready.
+
+        The gpu is the slot given by the scheduler, for executors that pick
+        the device themselves. With fresh, the jobs don't reuse a worker that
+        was kept around from earlier calls (e.g. to retry a failure away from
+        the worker it happened on).
+        """
+        for benchmark, settings, parameters in jobs:
+            try:
+                yield self.run(benchmark, settings, parameters, fresh=fresh)
+            except Exception as exc:
+                yield exc
+
+
+class FalExecutor(Executor):
+    """Runs the benchmark on fal's GPU workers (through the nomad scheduler)."""
+
+    def __init__(
+        self,
+        machine_type: str,
+        target_node: str | None = None,
+        datacenters: list[str] | None = None,
+        keep_alive: int = 0,
+    ) -> None:
+        self.machine_type = machine_type
+        self.target_node = target_node
+        self.datacenters = datacenters
+        # Seconds fal keeps a worker around after a call. The jobs of a group
+        # are called back to back, so they all land on the first one's worker
+        # (with the environment installed and the process already started).
+        self.keep_alive = keep_alive
+
+    def run(
+        self,
+        benchmark: dict,
+        settings: BenchmarkSettings,
+        parameters: InputParameters,
+        fresh: bool = False,
+    ) -> BenchmarkResults:
+        # A call without keep-alive has other machine requirements than the
+        # warm workers of the groups, so it isn't served by one of them (and
+        # its own worker isn't kept around either).
+        function = benchmark["function"].on(
+            machine_type=self.machine_type,
+            keep_alive=0 if fresh else self.keep_alive,
+            _scheduler="nomad",
+        )
+        if self.target_node:
+            function = function.on(
+                _scheduler_options={
+                    "target_node": self.target_node,
+                }
+            )
+
+        if self.datacenters:
+            function = function.on(
+                _scheduler_options={
+                    "datacenters": self.datacenters,
+                }
+            )
+
+        return function(
+            benchmark_settings=settings,
+            parameters=parameters,
+            **benchmark.get("kwargs", {}),
+        )
+
+
+class InProcessExecutor(Executor):
+    """Calls the benchmark function directly, in the current process and
+    environment. Mostly useful with stub benchmarks, to exercise the
+    orchestration offline.
+    """
+
+    def run(
+        self,
+        benchmark: dict,
+        settings: BenchmarkSettings,
+        parameters: InputParameters,
+        fresh: bool = False,
+    ) -> BenchmarkResults:
+        # There is no worker to replace, everything runs in this process.
+        function = unwrap(benchmark["function"])
+        return function(
+            benchmark_settings=settings,
+            parameters=parameters,
+            **benchmark.get("kwargs", {}),
+        )
+
+
+class LocalSubprocessExecutor(Executor):
+    """Runs the benchmark on the local machine, in a subprocess that uses a
+    virtualenv built from the benchmark's requirements. The virtualenvs
+    are cached (by their requirements) under venvs_dir.
+    """
+
+    def __init__(self, venvs_dir: Path = DEFAULT_VENVS_DIR) -> None:
+        self.venvs_dir = venvs_dir
+        self._lock = threading.Lock()
+
+    def prepare_venv(self, requirements: list[str]) -> Path:
+        digest = hashlib.sha256("\n".join(requirements).encode()).hexdigest()[:16]
+        venv_dir = self.venvs_dir / digest
+        python = venv_dir / "bin" / "python"
+
+        # The marker is only written after a successful install, so partially
+        # built environments are rebuilt from scratch.
+        marker = venv_dir / ".installed"
+        if not marker.exists():
+            print(f"Creating a virtualenv for {requirements} at {venv_dir}")
+            venv.create(venv_dir, clear=True, with_pip=True)
+            # The runner modules import fal at the top-level, even when the
+            # functions themselves are called locally.
+            subprocess.check_call(
+                [str(python), "-m", "pip", "install", *requirements, "fal"]
+            )
+            marker.touch()
+
+        return python
+
+    def run(
+        self,
+        benchmark: dict,
+        settings: BenchmarkSettings,
+        parameters: InputParameters,
+        fresh: bool = False,
+    ) -> BenchmarkResults:
+        [results] = self.run_group([(benchmark, settings, parameters)])
+        if isinstance(results, Exception):
+            raise results
+        return results
+
+    def run_group(
+        self,
+        jobs: list[Job],
+        gpu: int | None = None,
+        fresh: bool = False,
+    ) -> Iterator[BenchmarkResults | Exception]:
+        # All the jobs share the same requirements (see group_key), so they
+        # are sent one by one to a single worker process over its stdin and
+        # their results are read back from a dedicated pipe. Each group gets
+        # a new worker process, so they are always fresh.
+        with self._lock:
+            python = self.prepare_venv(get_requirements(jobs[0][0]))
+
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join(
+                filter(None, [str(PROJECT_DIR), os.environ.get("PYTHONPATH")])
+            ),
+        }
+        if gpu is not None:
+            env["CUDA_VISIBLE_DEVICES"] = str(gpu)
+
+        remaining = list(jobs)
+        while remaining:
+            # Only a worker that dies is replaced, along with its warm state.
+            yield from self._run_worker(python, env, remaining)
+
+    def _run_worker(
+        self,
+        python: Path,
+        env: dict[str, str],
+        remaining: list[Job],
+    ) -> Iterator[BenchmarkResults | Exception]:
+        read_fd, write_fd = os.pipe()
+        with subprocess.Popen(
+            [str(python), "-m", "benchmarks.worker", str(write_fd)],
+            stdin=subprocess.PIPE,
+            env=env,
+            pass_fds=[write_fd],
+        ) as process, open(read_fd, "rb") as results:
+            os.close(write_fd)
+            assert process.stdin is not None
+            while remaining:
+                benchmark, settings, parameters = remaining.pop(0)
+                function = unwrap(benchmark["function"])
+                pickle.dump(
+                    {
+                        "module": function.__module__,
+                        "function": function.__name__,
+                        "kwargs": {
+                            "benchmark_settings": settings,
+                            "parameters": parameters,
+                            **benchmark.get("kwargs", {}),
+                        },
+                    },
+                    process.stdin,
+                )
+                process.stdin.flush()
+                try:
+                    yield pickle.load(results)
+                except EOFError:
+                    # The worker died (e.g. segfault or OOM kill) while
+                    # running this job.
+                    process.wait()
+                    yield RuntimeError(f"Worker exited with {process.returncode}")
+                    return
+            process.stdin.close()
+
+
+EXECUTORS = ["fal", "subprocess", "in-process"]
+
+
+def create_executor(options: argparse.Namespace) -> Executor:
+    if options.executor == "fal":
+        return FalExecutor(
+            machine_type=options.machine_type,
+            target_node=options.target_node,
+            datacenters=options.datacenters,
+            keep_alive=options.keep_alive,
+        )
+    elif options.executor == "subprocess":
+        return LocalSubprocessExecutor(options.venvs_dir)
+    elif options.executor == "in-process":
+        return InProcessExecutor()
+    else:
+        raise ValueError(f"Unknown executor: {options.executor}")
+
+
+def local_gpu_count() -> int:
+    if shutil.which("nvidia-smi") is None:
+        return 1
+
+    output = subprocess.run(
+        ["nvidia-smi", "--list-gpus"], capture_output=True, text=True
+    ).stdout
+    return max(len(output.splitlines()), 1)
+
+
+def executor_capacity(options: argparse.Namespace) -> int:
+    """How many benchmarks can run at once without sharing a GPU."""
+    if options.executor == "in-process":
+        return 1
+    elif options.executor == "subprocess":
+        return options.gpus_per_node or local_gpu_count()
+    elif options.target_node:
+        # All the workers are placed on the same node.
+        return options.gpus_per_node or 8
+    else:
+        # Spread over fal's nodes, each call gets a GPU of its own.
+        return options.max_concurrency
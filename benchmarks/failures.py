@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import re
+import traceback
+from dataclasses import dataclass
+
+# Failures that are worth retrying, matched against the name of the error
+# type and its message: running out of device memory (e.g. during the warmup,
+# with a fragmented caching allocator), losing the worker (preemption, OOM
+# kill) and network hiccups while downloading the weights.
+TRANSIENT_ERROR_TYPES = (
+    "OutOfMemoryError",
+    "Connection",  # ConnectionError, ConnectionResetError, etc.
+    "Timeout",  # TimeoutError, ReadTimeout, ConnectTimeout, etc.
+    "ChunkedEncodingError",
+    "IncompleteRead",
+    "HfHubHTTPError",
+)
+TRANSIENT_ERROR_MESSAGE = re.compile(
+    r"out of memory|preempt|worker (exited|died|lost)|connection (reset|refused|"
+    r"aborted)|timed out|temporarily unavailable|too many requests",
+    re.IGNORECASE,
+)
+
+
+class BenchmarkError(Exception):
+    """An error raised by a benchmark on a worker, carried over as plain
+    strings since its type might not be importable by the orchestrator
+    (e.g. torch's OutOfMemoryError).
+    """
+
+    def __init__(self, error_type: str, message: str, formatted_traceback: str):
+        super().__init__(error_type, message, formatted_traceback)
+        self.error_type = error_type
+        self.message = message
+        self.formatted_traceback = formatted_traceback
+
+    def __str__(self) -> str:
+        return f"{self.error_type}: {self.message}"
+
+    @classmethod
+    def wrap(cls, exc: BaseException) -> BenchmarkError:
+        if isinstance(exc, cls):
+            return exc
+
+        error_type = type(exc).__qualname__
+        if type(exc).__module__ != "builtins":
+            error_type = f"{type(exc).__module__}.{error_type}"
+        return cls(error_type, str(exc), "".join(traceback.format_exception(exc)))
+
+
+def describe_error(exc: BaseException) -> dict[str, str]:
+    error = BenchmarkError.wrap(exc)
+    return {
+        "type": error.error_type,
+        "message": error.message,
+        "traceback": error.formatted_traceback,
+    }
+
+
+def is_transient(error: dict[str, str]) -> bool:
+    return any(
+        error_type in error["type"] for error_type in TRANSIENT_ERROR_TYPES
+    ) or bool(TRANSIENT_ERROR_MESSAGE.search(error["message"]))
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 3
+
+    # Total number of retries for the whole session, so that a broken
+    # environment (or service) can't keep a session going forever.
+    budget: int = 10
+
+    # Seconds before the first retry, doubled for each of the next ones.
+    backoff: float = 30.0
+
+    def should_retry(self, error: dict[str, str], attempt: int) -> bool:
+        if attempt >= self.max_attempts or self.budget <= 0:
+            return False
+        elif not is_transient(error):
+            return False
+
+        self.budget -= 1
+        return True
+
+    def delay(self, attempt: int) -> float:
+        return self.backoff * 2 ** (attempt - 1)
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import functools
+import json
+import math
+import re
+import statistics
+from argparse import ArgumentParser
+from collections import defaultdict
+from pathlib import Path
+from typing import Any
+
+from benchmarks.session import result_parameters, write_session
+
+# The reference of each category, i.e. out-of-box fp16 diffusers.
+REFERENCE_NAME = "Diffusers (torch 2.1, SDPA)"
+
+
+def load_pixels(image_file: Path) -> Any:
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(image_file) as image:
+        return np.asarray(image.convert("RGB"), dtype=np.float64)
+
+
+def psnr(image: Any, reference: Any) -> float:
+    import numpy as np
+
+    mse = float(np.mean((image - reference) ** 2))
+    if mse == 0:
+        return math.inf
+    return 10 * math.log10(255**2 / mse)
+
+
+def ssim(image: Any, reference: Any) -> float:
+    """Structural similarity of the luma of the two images, with the usual
+    11x11 gaussian window (sigma 1.5) of Wang et al.
+    """
+    import numpy as np
+
+    def luma(pixels: Any) -> Any:
+        return pixels @ np.array([0.299, 0.587, 0.114])
+
+    taps = np.exp(-((np.arange(11) - 5) ** 2) / (2 * 1.5**2))
+    taps /= taps.sum()
+
+    def blur(values: Any) -> Any:
+        # Separable, and only over the windows that fit in the image.
+        rows, columns = values.shape
+        values = sum(
+            weight * values[offset : rows - 10 + offset]
+            for offset, weight in enumerate(taps)
+        )
+        return sum(
+            weight * values[:, offset : columns - 10 + offset]
+            for offset, weight in enumerate(taps)
+        )
+
+    x, y = luma(image), luma(reference)
+    mu_x, mu_y = blur(x), blur(y)
+    var_x = blur(x * x) - mu_x**2
+    var_y = blur(y * y) - mu_y**2
+    covariance = blur(x * y) - mu_x * mu_y
+
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * covariance + c2)) / (
+        (mu_x**2 + mu_y**2 + c1) * (var_x + var_y + c2)
+    )
+    return float(ssim_map.mean())
+
+
+@functools.cache
+def lpips_model() -> Any:
+    import lpips
+
+    return lpips.LPIPS(net="alex", verbose=False)
+
+
+def lpips_distance(image: Any, reference: Any) -> float | None:
+    try:
+        import torch
+
+        model = lpips_model()
+    except ImportError:
+        # LPIPS needs torch and the lpips package, which the other metrics
+        # don't.
+        return None
+
+    def to_tensor(pixels: Any) -> Any:
+        # HWC in [0, 255] to NCHW in [-1, 1].
+        tensor = torch.from_numpy(pixels).float().permute(2, 0, 1).unsqueeze(0)
+        return tensor / 127.5 - 1
+
+    with torch.no_grad():
+        return float(model(to_tensor(image), to_tensor(reference)))
+
+
+def fidelity(image_file: Path, reference_file: Path) -> dict[str, Any]:
+    image, reference = load_pixels(image_file), load_pixels(reference_file)
+    if image.shape != reference.shape:
+        raise ValueError(
+            f"{image_file} and {reference_file} have different resolutions"
+        )
+
+    # PSNR is infinite for identical images, which JSON can't represent.
+    image_psnr = psnr(image, reference)
+    return {
+        "psnr": None if math.isinf(image_psnr) else image_psnr,
+        "ssim": ssim(image, reference),
+        "lpips": lpips_distance(image, reference),
+    }
+
+
+def pareto_frontier(points: dict[str, tuple[float, float]]) -> set[str]:
+    """Keys of the (latency, fidelity) points that no other point beats on
+    both, i.e. that are both faster and more faithful.
+    """
+    frontier = set()
+    best_fidelity = -math.inf
+    for key, (_, point_fidelity) in sorted(points.items(), key=lambda kv: kv[1]):
+        if point_fidelity > best_fidelity:
+            frontier.add(key)
+            best_fidelity = point_fidelity
+    return frontier
+
+
+def plot_frontiers(session: dict, plot_dir: Path) -> None:
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    points = defaultdict(dict)
+    for result in session["timings"]:
+        if result.get("fidelity") and result_parameters(result, session) == (
+            session["parameters"]
+        ):
+            points[result["category"]][result["name"]] = (
+                statistics.median(result["timings"]),
+                result["fidelity"]["ssim"],
+            )
+
+    plot_dir.mkdir(parents=True, exist_ok=True)
+    for category, category_points in points.items():
+        frontier = pareto_frontier(category_points)
+        figure, axes = plt.subplots(figsize=(8, 6))
+        for name, (latency, point_fidelity) in category_points.items():
+            axes.scatter(
+                latency, point_fidelity, color="C1" if name in frontier else "C0"
+            )
+            axes.annotate(name, (latency, point_fidelity), fontsize=7)
+        axes.plot(
+            *zip(*sorted(category_points[name] for name in frontier)),
+            color="C1",
+            linestyle="--",
+        )
+        axes.set_xlabel("median latency (s)")
+        axes.set_ylabel("SSIM against the reference")
+        axes.set_title(category)
+        stem = re.sub(r"[^a-z0-9]+", "-", category.lower()).strip("-")
+        figure.savefig(plot_dir / f"{stem}.png", dpi=150, bbox_inches="tight")
+        plt.close(figure)
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Compare the images of a session (see --capture-image) "
+        "against the reference of their category, and record the fidelity "
+        "metrics in the session file."
+    )
+    parser.add_argument("session_file", type=Path)
+    parser.add_argument("--reference", default=REFERENCE_NAME)
+    parser.add_argument(
+        "--plot-dir",
+        type=Path,
+        default=None,
+        help="Also plot the latency/fidelity frontier of each category here "
+        "(needs matplotlib).",
+    )
+
+    options = parser.parse_args()
+    session = json.loads(options.session_file.read_text())
+
+    references = {
+        (result["category"], json.dumps(result_parameters(result, session))): result
+        for result in session["timings"]
+        if result["name"] == options.reference and result.get("image")
+    }
+    for result in session["timings"]:
+        reference = references.get(
+            (result["category"], json.dumps(result_parameters(result, session)))
+        )
+        if not result.get("image") or reference is None:
+            continue
+
+        result["fidelity"] = {
+            "reference": options.reference,
+            **fidelity(
+                options.session_file.parent / result["image"],
+                options.session_file.parent / reference["image"],
+            ),
+        }
+        print(f"{result['category']} / {result['name']}: {result['fidelity']}")
+
+    write_session(options.session_file, session)
+    if options.plot_dir is not None:
+        plot_frontiers(session, options.plot_dir)
+
+
+if __name__ == "__main__":
+    main()
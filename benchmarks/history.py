@@ -0,0 +1,377 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import statistics
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+from rich.console import Console
+from rich.markup import escape
+from rich.table import Table
+
+from benchmarks.session import pack_timings, result_parameters, unpack_timings
+from benchmarks.stats import mann_whitney_u
+
+# Sessions are only ever added, never updated, so the whole history of every
+# benchmark can be queried through the indexes without re-reading the
+# session files. Results that a session reused from a previous one (same
+# cache key and timings) are stored once, as a measurement of the session
+# that first ran them, and only linked to the later sessions.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    digest TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    recorded_at TEXT NOT NULL,
+    fingerprint TEXT,
+    settings TEXT NOT NULL,
+    parameters TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    id TEXT PRIMARY KEY,
+    session INTEGER NOT NULL REFERENCES sessions (id),
+    recorded_at TEXT NOT NULL,
+    fingerprint TEXT,
+    cache_key TEXT,
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    median REAL NOT NULL,
+    mean REAL NOT NULL,
+    minimum REAL NOT NULL,
+    maximum REAL NOT NULL,
+    timings TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS session_measurements (
+    session INTEGER NOT NULL REFERENCES sessions (id),
+    measurement TEXT NOT NULL REFERENCES measurements (id),
+    PRIMARY KEY (session, measurement)
+);
+CREATE TABLE IF NOT EXISTS failures (
+    session INTEGER NOT NULL REFERENCES sessions (id),
+    recorded_at TEXT NOT NULL,
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    error_type TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_by_date ON sessions (recorded_at);
+CREATE INDEX IF NOT EXISTS measurements_by_benchmark
+    ON measurements (category, name, parameters, recorded_at);
+CREATE INDEX IF NOT EXISTS measurements_by_name ON measurements (name, recorded_at);
+CREATE INDEX IF NOT EXISTS measurements_by_fingerprint
+    ON measurements (fingerprint, recorded_at);
+CREATE INDEX IF NOT EXISTS measurements_by_date ON measurements (recorded_at);
+CREATE INDEX IF NOT EXISTS session_measurements_by_measurement
+    ON session_measurements (measurement);
+CREATE INDEX IF NOT EXISTS failures_by_benchmark
+    ON failures (category, name, recorded_at);
+"""
+
+
+def canonical(value: object) -> str:
+    return json.dumps(value, sort_keys=True)
+
+
+def digest(value: object) -> str:
+    return hashlib.sha256(canonical(value).encode()).hexdigest()
+
+
+def session_fingerprint(session: dict) -> str | None:
+    # The machine the session ran on, as far as we know it. Sessions from
+    # before the environment was recorded don't have one.
+    if environment := session.get("environment"):
+        return digest(environment)[:12]
+    return None
+
+
+@dataclass
+class Measurement:
+    session: str
+    recorded_at: str
+    fingerprint: str | None
+    category: str
+    name: str
+    parameters: dict
+    median: float
+    timings: list[float]
+
+
+class HistoryStore:
+    def __init__(self, path: Path) -> None:
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def ingest(self, name: str, session: dict, recorded_at: datetime) -> bool:
+        """Add a session to the history. Returns False if the very same
+        session was already ingested.
+        """
+        session_digest = digest(session)
+        fingerprint = session_fingerprint(session)
+        timestamp = recorded_at.astimezone(timezone.utc).isoformat()
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO sessions (digest, name, recorded_at, "
+                "fingerprint, settings, parameters) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    session_digest,
+                    name,
+                    timestamp,
+                    fingerprint,
+                    canonical(session["settings"]),
+                    canonical(session["parameters"]),
+                ),
+            )
+            if not cursor.rowcount:
+                return False
+
+            session_id = cursor.lastrowid
+            for result in session["timings"]:
+                timings = result["timings"]
+                measurement_id = digest([result.get("cache_key"), timings])
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO measurements (id, session, recorded_at, "
+                    "fingerprint, cache_key, category, name, parameters, median, "
+                    "mean, minimum, maximum, timings) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        measurement_id,
+                        session_id,
+                        timestamp,
+                        fingerprint,
+                        result.get("cache_key"),
+                        result["category"],
+                        result["name"],
+                        canonical(result_parameters(result, session)),
+                        statistics.median(timings),
+                        statistics.mean(timings),
+                        min(timings),
+                        max(timings),
+                        pack_timings(timings),
+                    ),
+                )
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO session_measurements VALUES (?, ?)",
+                    (session_id, measurement_id),
+                )
+
+            self.connection.executemany(
+                "INSERT INTO failures VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        session_id,
+                        timestamp,
+                        failure["category"],
+                        failure["name"],
+                        canonical(failure["parameters"]),
+                        failure["error"]["type"],
+                        failure["error"]["message"],
+                    )
+                    for failure in session.get("failures", [])
+                ],
+            )
+        return True
+
+    def measurements(
+        self,
+        name: str | None = None,
+        category: str | None = None,
+        parameters: dict | None = None,
+        since: str | None = None,
+    ) -> Iterator[Measurement]:
+        """Measurements in chronological order, optionally filtered by a
+        part of the benchmark's name/category (case insensitive).
+        """
+        query = (
+            "SELECT sessions.name, measurements.recorded_at, measurements.fingerprint,"
+            " category, measurements.name, measurements.parameters, median, timings"
+            " FROM measurements JOIN sessions ON sessions.id = measurements.session"
+            " WHERE 1"
+        )
+        arguments: list[str] = []
+        if name is not None:
+            query += " AND measurements.name LIKE ?"
+            arguments.append(f"%{name}%")
+        if category is not None:
+            query += " AND category LIKE ?"
+            arguments.append(f"%{category}%")
+        if parameters is not None:
+            query += " AND measurements.parameters = ?"
+            arguments.append(canonical(parameters))
+        if since is not None:
+            query += " AND measurements.recorded_at >= ?"
+            arguments.append(since)
+        query += " ORDER BY measurements.recorded_at, measurements.rowid"
+
+        for row in self.connection.execute(query, arguments):
+            (session, recorded_at, fingerprint, category, name, parameters) = row[:6]
+            yield Measurement(
+                session=session,
+                recorded_at=recorded_at,
+                fingerprint=fingerprint,
+                category=category,
+                name=name,
+                parameters=json.loads(parameters),
+                median=row[6],
+                timings=unpack_timings(row[7]),
+            )
+
+    def latest_parameters(self) -> dict | None:
+        row = self.connection.execute(
+            "SELECT parameters FROM sessions ORDER BY recorded_at DESC LIMIT 1"
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+
+def series(
+    measurements: Iterator[Measurement],
+) -> dict[tuple[str, str, str, str | None], list[Measurement]]:
+    # Measurements are only comparable on the same machine and parameters.
+    all_series: dict[tuple[str, str, str, str | None], list[Measurement]] = {}
+    for measurement in measurements:
+        key = (
+            measurement.category,
+            measurement.name,
+            canonical(measurement.parameters),
+            measurement.fingerprint,
+        )
+        all_series.setdefault(key, []).append(measurement)
+    return all_series
+
+
+def record_session(history_file: Path, name: str, session: dict) -> None:
+    store = HistoryStore(history_file)
+    try:
+        store.ingest(name, session, datetime.now(timezone.utc))
+    finally:
+        store.close()
+
+
+def benchmark_title(measurement: Measurement) -> str:
+    title = f"{measurement.category.split(' ')[0]:5} {measurement.name}"
+    if measurement.fingerprint is not None:
+        title += f" @{measurement.fingerprint}"
+    return escape(title)
+
+
+def trend_table(all_series: dict) -> Table:
+    table = Table("Benchmark", "Date", "Session", "Median", "Change")
+    for measurements in all_series.values():
+        previous = None
+        for measurement in measurements:
+            change = ""
+            if previous is not None:
+                change = f"{measurement.median / previous.median - 1:+.1%}"
+            table.add_row(
+                benchmark_title(measurement) if previous is None else "",
+                measurement.recorded_at[:10],
+                escape(measurement.session),
+                f"{measurement.median:.3f}s",
+                change,
+            )
+            previous = measurement
+        table.add_section()
+    return table
+
+
+def changes_table(all_series: dict, threshold: float, alpha: float) -> Table:
+    table = Table("Benchmark", "Date", "Session", "Before", "After", "Change", "p")
+    for measurements in all_series.values():
+        for before, after in zip(measurements, measurements[1:]):
+            change = after.median / before.median - 1
+            if abs(change) <= threshold:
+                continue
+
+            p_value = mann_whitney_u(before.timings, after.timings)
+            if p_value >= alpha:
+                continue
+
+            color = "red" if change > 0 else "green"
+            table.add_row(
+                benchmark_title(after),
+                after.recorded_at[:10],
+                escape(after.session),
+                f"{before.median:.3f}s",
+                f"{after.median:.3f}s",
+                f"[{color}]{change:+.1%}[/{color}]",
+                f"{p_value:.3f}",
+            )
+    return table
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Query the history of the benchmarks.")
+    parser.add_argument("history_file", type=Path)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser(
+        "ingest",
+        help="Add session files to the history, dated by their modification time.",
+    )
+    ingest.add_argument("session_files", type=Path, nargs="+")
+
+    for command, description in [
+        ("trend", "Median latency of each benchmark over time."),
+        ("changes", "Points in time where a benchmark got faster or slower."),
+    ]:
+        query = commands.add_parser(command, help=description)
+        query.add_argument("--name", help="Part of the benchmark names to show.")
+        query.add_argument("--category", help="Part of the categories to show.")
+        query.add_argument("--since", help="ISO date of the oldest session to show.")
+        query.add_argument(
+            "--all-parameters",
+            action="store_true",
+            help="Include the sweeps, rather than only the benchmarks run with "
+            "the parameters of the latest session.",
+        )
+        if command == "changes":
+            query.add_argument("--threshold", type=float, default=0.05)
+            query.add_argument("--alpha", type=float, default=0.05)
+
+    options = parser.parse_args()
+    store = HistoryStore(options.history_file)
+    try:
+        with Console() as console:
+            if options.command == "ingest":
+                for session_file in options.session_files:
+                    recorded_at = datetime.fromtimestamp(
+                        session_file.stat().st_mtime, timezone.utc
+                    )
+                    session = json.loads(session_file.read_text())
+                    if store.ingest(session_file.stem, session, recorded_at):
+                        console.print(f"Ingested {session_file}")
+                    else:
+                        console.print(f"Skipping {session_file} (already ingested)")
+                return
+
+            all_series = series(
+                store.measurements(
+                    name=options.name,
+                    category=options.category,
+                    parameters=(
+                        None if options.all_parameters else store.latest_parameters()
+                    ),
+                    since=options.since,
+                )
+            )
+            if options.command == "trend":
+                console.print(trend_table(all_series))
+            else:
+                console.print(
+                    changes_table(all_series, options.threshold, options.alpha)
+                )
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import base64
+import io
+import re
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+# All the images are generated from the same initial noise, so that they
+# only differ by what the optimizations change.
+IMAGE_SEED = 0
+
+
+def seeded_image(pipeline_call: Callable[..., Any]) -> Callable[[], Any]:
+    """Turn a (partially applied) diffusers pipeline call into one that
+    returns its first image, generated from IMAGE_SEED.
+    """
+
+    def generate() -> Any:
+        import torch
+
+        generator = torch.Generator("cuda").manual_seed(IMAGE_SEED)
+        return pipeline_call(generator=generator).images[0]
+
+    return generate
+
+
+def encode_image(image: Any) -> str:
+    # PNG, so that the metrics only see the differences of the backends and
+    # not those of a lossy encoding.
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def write_image(images_dir: Path, name: str, image: str) -> str:
+    """Write an encoded image to the given directory, and return its path
+    relative to the session file (which sits next to the directory).
+    """
+    images_dir.mkdir(parents=True, exist_ok=True)
+    stem = re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+    image_file = images_dir / f"{stem}.png"
+    image_file.write_bytes(base64.b64decode(image))
+    return f"{images_dir.name}/{image_file.name}"
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import functools
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+# Canonical stage names, shared by all runners so the tables can line
+# them up against each other.
+TEXT_ENCODER = "text_encoder"
+UNET = "unet"
+VAE_DECODE = "vae_decode"
+STAGES = (TEXT_ENCODER, UNET, VAE_DECODE)
+
+# Same, but for the one-time setup of a pipeline (cold start). The first
+# inference is filled by the benchmark settings.
+LOAD = "load"
+TO_DEVICE = "to_device"
+COMPILE = "compile"
+FIRST_INFERENCE = "first_inference"
+SETUP_STAGES = (LOAD, TO_DEVICE, COMPILE, FIRST_INFERENCE)
+
+
+class StageTimer:
+    """Accumulates wall time spent in named stages of a single inference.
+
+    Timing a stage on the GPU requires synchronizing the device at its
+    boundaries, which removes the overlap between the CPU launching the
+    next kernels and the GPU finishing the previous ones. For that reason
+    the timer is disabled by default and only enabled by the benchmark
+    settings for dedicated (non-timed) iterations. Timers for the one-time
+    setup can be enabled right away.
+    """
+
+    def __init__(
+        self,
+        synchronize: Callable[[], Any] | None = None,
+        enabled: bool = False,
+    ) -> None:
+        self.synchronize = synchronize
+        self.enabled = enabled
+        self._totals: dict[str, float] = defaultdict(float)
+        self._depth = 0
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        # Nested stages (e.g. SDXL's encode_prompt calling the text encoders)
+        # are only counted once, by the outermost one.
+        if not self.enabled or self._depth:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+
+        self._depth += 1
+        self._sync()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._sync()
+            self._totals[name] += time.perf_counter() - t0
+            self._depth -= 1
+
+    def wrap(self, owner: Any, attribute: str, name: str) -> None:
+        """Replace `owner.attribute` (a callable) with a version that is
+        accounted under the given stage.
+        """
+        original = getattr(owner, attribute)
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return original(*args, **kwargs)
+
+        setattr(owner, attribute, wrapper)
+
+    def record(self, name: str, elapsed: float) -> None:
+        """Account an already measured duration under the given stage."""
+        self._totals[name] += elapsed
+
+    def collect(self) -> dict[str, float]:
+        """Return the stage totals since the last call and reset them."""
+        totals, self._totals = dict(self._totals), defaultdict(float)
+        return totals
+
+    def _sync(self) -> None:
+        if self.synchronize is not None:
+            self.synchronize()
+
+
+class StepTimer:
+    """Records the time each denoising step takes, from the step callback of
+    the pipelines. Like the StageTimer, it synchronizes the device at each
+    step so it is only enabled for the stage iterations.
+    """
+
+    def __init__(
+        self,
+        synchronize: Callable[[], Any] | None = None,
+        enabled: bool = False,
+    ) -> None:
+        self.synchronize = synchronize
+        self.enabled = enabled
+        self._last: float | None = None
+        self._steps: list[float] = []
+
+    def start(self) -> None:
+        """Mark the start of the first step."""
+        if self.enabled:
+            self._sync()
+            self._last = time.perf_counter()
+
+    def step(self, *args: Any, **kwargs: Any) -> None:
+        """Mark the end of a step (takes any arguments, so that it can be
+        passed as the step callback directly).
+        """
+        if not self.enabled or self._last is None:
+            return
+
+        self._sync()
+        now = time.perf_counter()
+        self._steps.append(now - self._last)
+        self._last = now
+
+    def collect(self) -> list[float]:
+        """Return the step timings since the last call and reset them."""
+        steps, self._steps, self._last = self._steps, [], None
+        return steps
+
+    def _sync(self) -> None:
+        if self.synchronize is not None:
+            self.synchronize()
+
+
+def instrument_diffusers_pipeline(pipeline: Any) -> StageTimer:
+    """Attach a stage timer to a diffusers pipeline (or anything that
+    exposes the same `encode_prompt` / `unet` / `vae.decode` surface).
+
+    This needs to be called after the pipeline is fully set up (compiled,
+    moved to the device, etc.) since it patches the final objects.
+    """
+    import torch
+
+    timer = StageTimer(synchronize=torch.cuda.synchronize)
+    timer.wrap(pipeline, "encode_prompt", TEXT_ENCODER)
+    timer.wrap(pipeline.unet, "forward", UNET)
+    timer.wrap(pipeline.vae, "decode", VAE_DECODE)
+    return timer
+
+
+def instrument_diffusers_steps(pipeline: Any) -> StepTimer:
+    """Attach a step timer to a diffusers pipeline. The denoising loop starts
+    right after the latents are prepared; each step ends with the callback,
+    so `timer.step` needs to be passed as the pipeline's `callback` (with
+    `callback_steps=1`).
+    """
+    import torch
+
+    timer = StepTimer(synchronize=torch.cuda.synchronize)
+    prepare_latents = pipeline.prepare_latents
+
+    @functools.wraps(prepare_latents)
+    def wrapper(*args, **kwargs):
+        latents = prepare_latents(*args, **kwargs)
+        timer.start()
+        return latents
+
+    pipeline.prepare_latents = wrapper
+    return timer
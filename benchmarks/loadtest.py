@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import random
+import statistics
+import threading
+import time
+from argparse import ArgumentParser
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from typing import Any
+
+from benchmarks.stats import percentiles
+
+OPEN_LOOP = "open"
+CLOSED_LOOP = "closed"
+
+
+@dataclass
+class LoadTestSettings:
+    # "open" sends requests following a Poisson process at the given qps,
+    # regardless of how fast they are served. "closed" has a fixed number
+    # of clients, each sending the next request when the previous one is
+    # done.
+    mode: str = CLOSED_LOOP
+    qps: float = 1.0
+    concurrency: int = 4
+    requests: int = 50
+
+    # Number of requests the pipeline serves at once. A single pipeline
+    # is not thread-safe (the schedulers are stateful), so the rest are
+    # queued just like they would be in front of a single replica.
+    workers: int = 1
+    seed: int = 0
+
+
+@dataclass
+class RequestTiming:
+    arrival: float
+    start: float = 0.0
+    end: float = 0.0
+
+    @property
+    def queue_delay(self) -> float:
+        return self.start - self.arrival
+
+    @property
+    def latency(self) -> float:
+        return self.end - self.arrival
+
+
+def run_load_test(
+    test_fn: Callable[[], Any],
+    settings: LoadTestSettings,
+) -> dict[str, Any]:
+    """Drive test_fn with concurrent requests and return the latency
+    percentiles, queueing delay and sustained throughput.
+    """
+    requests: list[RequestTiming] = []
+    lock = threading.Lock()
+
+    def serve(request: RequestTiming) -> None:
+        request.start = time.perf_counter()
+        test_fn()
+        request.end = time.perf_counter()
+
+    def submit(server: ThreadPoolExecutor):
+        request = RequestTiming(arrival=time.perf_counter())
+        with lock:
+            requests.append(request)
+        return server.submit(serve, request)
+
+    with ThreadPoolExecutor(max_workers=settings.workers) as server:
+        if settings.mode == OPEN_LOOP:
+            rng = random.Random(settings.seed)
+            futures = []
+            next_arrival = time.perf_counter()
+            for _ in range(settings.requests):
+                time.sleep(max(0.0, next_arrival - time.perf_counter()))
+                futures.append(submit(server))
+                next_arrival += rng.expovariate(settings.qps)
+            wait(futures)
+            # Raises the first error of the requests, if any failed.
+            for future in futures:
+                future.result()
+        elif settings.mode == CLOSED_LOOP:
+            remaining = iter(range(settings.requests))
+            errors: list[BaseException] = []
+
+            def client() -> None:
+                while True:
+                    with lock:
+                        if errors or next(remaining, None) is None:
+                            return
+                    try:
+                        submit(server).result()
+                    except BaseException as exc:
+                        # Stops the other clients too, and is raised in the
+                        # caller once they are done.
+                        with lock:
+                            errors.append(exc)
+                        return
+
+            clients = [
+                threading.Thread(target=client) for _ in range(settings.concurrency)
+            ]
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+            if errors:
+                raise errors[0]
+        else:
+            raise ValueError(f"Unknown load test mode: {settings.mode}")
+
+    if unfinished := [request for request in requests if not request.end]:
+        raise RuntimeError(
+            f"{len(unfinished)} of the {len(requests)} load test requests "
+            "didn't finish"
+        )
+
+    duration = max(request.end for request in requests) - min(
+        request.arrival for request in requests
+    )
+    return {
+        "settings": asdict(settings),
+        "latency": percentiles([request.latency for request in requests]),
+        "queue_delay": percentiles([request.queue_delay for request in requests]),
+        "service_time": statistics.median(
+            request.end - request.start for request in requests
+        ),
+        "throughput": len(requests) / duration,
+        "duration": duration,
+    }
+
+
+def main() -> None:
+    # Runs the load generator against a stub pipeline that just sleeps, to
+    # check the queueing behavior locally without a GPU.
+    parser = ArgumentParser()
+    parser.add_argument("--stub-latency", type=float, default=0.1)
+    parser.add_argument("--mode", choices=[OPEN_LOOP, CLOSED_LOOP], default=CLOSED_LOOP)
+    parser.add_argument("--qps", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=1)
+
+    options = parser.parse_args()
+    settings = LoadTestSettings(
+        mode=options.mode,
+        qps=options.qps,
+        concurrency=options.concurrency,
+        requests=options.requests,
+        workers=options.workers,
+    )
+    results = run_load_test(lambda: time.sleep(options.stub_latency), settings)
+    for key, value in results.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
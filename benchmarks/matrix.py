@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import fnmatch
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+from typing import Any
+
+
+@dataclass
+class Variant:
+    name: str
+
+    # What tells this variant apart from the others of its backend, for the
+    # selection (e.g. {"compile": True}). Merged over the matrix defaults.
+    options: dict[str, Any] = field(default_factory=dict)
+    kwargs: dict[str, Any] = field(default_factory=dict)
+
+    # Kwargs that depend on the model, e.g. the tiny VAE that matches it.
+    model_kwargs: dict[str, dict[str, Any]] = field(default_factory=dict)
+
+    # Only run for these models, rather than for all of the matrix's.
+    models: list[str] | None = None
+
+
+@dataclass
+class BenchmarkMatrix:
+    """The variants of a backend, each run for every model (with the kwargs
+    of that model). Expands into the LOCAL_BENCHMARKS entries.
+    """
+
+    backend: str
+    function: Callable[..., Any]
+
+    # Kwargs of the function for each model, keyed by the model's name as
+    # used in the categories ("SD1.5", "SDXL").
+    models: dict[str, dict[str, Any]]
+    variants: list[Variant]
+
+    # Default value of the variants' options.
+    options: dict[str, Any] = field(default_factory=dict)
+
+    def expand(self) -> list[dict]:
+        # Model by model, so that the variants of a model stay next to each
+        # other (and in the given order) when they share a worker.
+        benchmarks = []
+        for model, model_kwargs in self.models.items():
+            for variant in self.variants:
+                if variant.models is not None and model not in variant.models:
+                    continue
+
+                benchmark = {
+                    "name": variant.name,
+                    "category": f"{model} (End-to-end)",
+                    "function": self.function,
+                    "tags": {
+                        "backend": self.backend,
+                        "model": model,
+                        **self.options,
+                        **variant.options,
+                    },
+                }
+                kwargs = {
+                    **model_kwargs,
+                    **variant.kwargs,
+                    **variant.model_kwargs.get(model, {}),
+                }
+                if kwargs:
+                    benchmark["kwargs"] = kwargs
+                benchmarks.append(benchmark)
+        return benchmarks
+
+
+def benchmark_tags(benchmark: dict, parameters: dict) -> dict[str, Any]:
+    """Everything a benchmark can be selected by: its name, its category,
+    the tags of its matrix (backend, model and options) and its parameters.
+    """
+    return {
+        "name": benchmark["name"],
+        "category": benchmark["category"],
+        **benchmark.get("tags", {}),
+        **parameters,
+    }
+
+
+def format_tag(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value).lower()
+
+
+@dataclass
+class Condition:
+    key: str
+    patterns: list[str]
+    negated: bool = False
+
+    def matches(self, tags: dict[str, Any]) -> bool:
+        matched = tags.get(self.key) is not None and any(
+            fnmatch.fnmatchcase(format_tag(tags[self.key]), pattern)
+            for pattern in self.patterns
+        )
+        return matched != self.negated
+
+
+@dataclass
+class Selection:
+    """A comma separated list of conditions that all need to match, like
+    `backend=diffusers,compile=true,category=SDXL*`. Each condition is either
+    `key=pattern` or `key!=pattern`, where the pattern is a case insensitive
+    glob and can list alternatives with `|` (e.g. `backend=oneflow|tensorrt`).
+
+    A bare term without `=` matches the names that contain it, so plain
+    names work as before.
+    """
+
+    conditions: list[Condition]
+
+    @classmethod
+    def parse(cls, expression: str) -> Selection:
+        conditions = []
+        for term in filter(None, map(str.strip, expression.split(","))):
+            key, operator, patterns = term.partition("=")
+            if not operator:
+                conditions.append(Condition("name", [f"*{term.lower()}*"]))
+                continue
+
+            negated = key.endswith("!")
+            conditions.append(
+                Condition(
+                    key.rstrip("!").strip(),
+                    [pattern.strip().lower() for pattern in patterns.split("|")],
+                    negated=negated,
+                )
+            )
+        return cls(conditions)
+
+    def matches(self, benchmark: dict, parameters: dict) -> bool:
+        tags = benchmark_tags(benchmark, parameters)
+        return all(condition.matches(tags) for condition in self.conditions)
+
+    def unknown_keys(self, known_keys: Iterable[str]) -> set[str]:
+        return {condition.key for condition in self.conditions} - set(known_keys)
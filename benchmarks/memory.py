@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import resource
+import sys
+
+# Keys of the collected memory stats (all in bytes).
+MODEL_RESIDENT = "device_model_resident"
+PEAK_ALLOCATED = "device_peak_allocated"
+PEAK_RESERVED = "device_peak_reserved"
+# A single reading of the whole device's used memory, once the timed
+# iterations are done, rather than a peak (see MemoryCollector).
+DEVICE_USED_AT_END = "device_used_at_end"
+HOST_PEAK_RSS = "host_peak_rss"
+MEMORY_KEYS = (
+    MODEL_RESIDENT,
+    PEAK_ALLOCATED,
+    PEAK_RESERVED,
+    DEVICE_USED_AT_END,
+    HOST_PEAK_RSS,
+)
+
+
+def host_peak_rss() -> int:
+    # The high water mark of /proc is the peak since the last reset (see
+    # reset_host_peak_rss), unlike ru_maxrss which is the peak of the whole
+    # process.
+    try:
+        with open("/proc/self/status") as stream:
+            for line in stream:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports it in kilobytes, macOS in bytes.
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def reset_host_peak_rss() -> None:
+    # Resets VmHWM to the current RSS (Linux 4.0+). Elsewhere the peak stays
+    # the one of the whole process.
+    try:
+        with open("/proc/self/clear_refs", "w") as stream:
+            stream.write("5")
+    except OSError:
+        pass
+
+
+class MemoryCollector:
+    """Collects the peak device and host memory of a benchmark.
+
+    The device stats come from the torch caching allocator, which doesn't
+    see the memory that is allocated by other runtimes (e.g. TensorRT's
+    cudaMalloc or OneFlow's own allocator) so the used memory of the whole
+    device is recorded as well, although only at the end of the run (it is
+    not tracked in between). Without CUDA, only the host RSS is collected.
+
+    The host peak RSS is reset by finish(), once the benchmark is done with
+    the worker, so that each of the benchmarks sharing a warm worker gets its
+    own peak (including its setup) rather than the largest one of the
+    benchmarks before it.
+    """
+
+    def __init__(self) -> None:
+        try:
+            import torch
+        except ImportError:
+            self.cuda = None
+        else:
+            self.cuda = torch.cuda if torch.cuda.is_available() else None
+        self.model_resident = 0
+
+    def start(self) -> None:
+        # Called right after the setup, so whatever is allocated at this
+        # point is the model itself (weights, buffers, engines).
+        if self.cuda is None:
+            return
+
+        self.cuda.synchronize()
+        self.model_resident = self.cuda.memory_allocated()
+        self.cuda.reset_peak_memory_stats()
+
+    def finish(self) -> None:
+        # After everything else the benchmark runs (load test, image capture,
+        # profiling), so that none of it counts towards the next benchmark.
+        reset_host_peak_rss()
+
+    def collect(self) -> dict[str, int]:
+        stats = {HOST_PEAK_RSS: host_peak_rss()}
+        if self.cuda is None:
+            return stats
+
+        self.cuda.synchronize()
+        free, total = self.cuda.mem_get_info()
+        stats.update(
+            {
+                MODEL_RESIDENT: self.model_resident,
+                PEAK_ALLOCATED: self.cuda.max_memory_allocated(),
+                PEAK_RESERVED: self.cuda.max_memory_reserved(),
+                DEVICE_USED_AT_END: total - free,
+            }
+        )
+        return stats
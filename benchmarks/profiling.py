@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import base64
+import gzip
+import re
+import sys
+import tempfile
+import threading
+from collections import Counter
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+# Number of operators/kernels kept in the summary of a profile.
+TOP_OPERATORS = 25
+
+
+def profile_iteration(test_fn: Callable[[], Any]) -> dict[str, Any]:
+    """Run a single iteration under torch.profiler, and return its Chrome
+    trace (gzipped and base64 encoded, so that it can be sent back from a
+    remote worker) along with the operators that took the most time.
+    """
+    import torch
+    from torch.profiler import ProfilerActivity, profile
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+
+    with profile(activities=activities) as profiler:
+        test_fn()
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    with tempfile.TemporaryDirectory() as trace_dir:
+        trace_file = Path(trace_dir) / "trace.json"
+        profiler.export_chrome_trace(str(trace_file))
+        trace = gzip.compress(trace_file.read_bytes())
+
+    # Renamed from cuda to device in torch 2.4.
+    def device_time(event: Any) -> float:
+        return getattr(
+            event, "self_device_time_total", getattr(event, "self_cuda_time_total", 0)
+        )
+
+    events = sorted(
+        profiler.key_averages(),
+        key=lambda event: (device_time(event), event.self_cpu_time_total),
+        reverse=True,
+    )
+    return {
+        "trace": base64.b64encode(trace).decode(),
+        "operators": [
+            {
+                "name": event.key,
+                "calls": event.count,
+                "self_cpu_time": event.self_cpu_time_total / 1e6,
+                "self_device_time": device_time(event) / 1e6,
+            }
+            for event in events[:TOP_OPERATORS]
+        ],
+    }
+
+
+def format_operators(operators: list[dict[str, Any]]) -> str:
+    lines = [f"{'self device (s)':>15}  {'self cpu (s)':>12}  {'calls':>7}  name"]
+    for operator in operators:
+        lines.append(
+            f"{operator['self_device_time']:15.4f}  {operator['self_cpu_time']:12.4f}"
+            f"  {operator['calls']:7}  {operator['name']}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def write_profile(
+    profiles_dir: Path,
+    name: str,
+    profile: dict[str, Any],
+) -> dict[str, Any]:
+    """Write the trace and the summary of a profile to the given directory,
+    and return what is kept in the session (the summary and their paths).
+    """
+    profiles_dir.mkdir(parents=True, exist_ok=True)
+    stem = re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+    trace_file = profiles_dir / f"{stem}.trace.json.gz"
+    trace_file.write_bytes(base64.b64decode(profile["trace"]))
+    summary_file = profiles_dir / f"{stem}.top.txt"
+    summary_file.write_text(format_operators(profile["operators"]))
+    # Relative to the session file, which sits next to the profiles.
+    return {
+        "trace": f"{profiles_dir.name}/{trace_file.name}",
+        "summary": f"{profiles_dir.name}/{summary_file.name}",
+        "operators": profile["operators"],
+    }
+
+
+class StackSampler:
+    """Samples the Python stacks of every thread of this process from a
+    background thread, and aggregates them in the folded format that
+    flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stopped.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append(
+                        f"{code.co_name} ({code.co_filename}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                thread_name = names.get(thread_id, str(thread_id))
+                self.stacks[";".join([thread_name, *reversed(calls)])] += 1
+
+    def write(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as stream:
+            for stack, count in self.stacks.most_common():
+                stream.write(f"{stack} {count}\n")
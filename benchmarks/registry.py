@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import hashlib
+import importlib
+import importlib.util
+import inspect
+import json
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from benchmarks.executors import get_requirements, unwrap
+
+BENCHMARK_MODULES = [
+    "benchmarks.benchmark_diffusers",
+    "benchmarks.benchmark_tensorrt",
+    "benchmarks.benchmark_oneflow",
+    "benchmarks.benchmark_minsdxl",
+    "benchmarks.benchmark_experimental",
+    "benchmarks.benchmark_comfy",
+    "benchmarks.benchmark_stablefast",
+]
+
+# Metadata of the benchmarks of each module (everything but their function),
+# so that they can be listed, selected and matched against previous results
+# without importing the modules, and with them fal and the backends.
+INDEX_FILE = Path(__file__).parent / "index.json"
+
+# What the entries of a module are expanded from, besides the module itself.
+MATRIX_FILE = Path(__file__).parent / "matrix.py"
+
+
+@dataclass(frozen=True)
+class LazyFunction:
+    """Stands in for the function of a benchmark from the index, until the
+    benchmark is actually run.
+    """
+
+    module: str
+    name: str
+    source_file: str
+
+    def load(self) -> Any:
+        return getattr(importlib.import_module(self.module), self.name)
+
+
+def function_file(function: Any) -> Path:
+    if isinstance(function, LazyFunction):
+        return Path(function.source_file)
+    return Path(inspect.getsourcefile(unwrap(function)))
+
+
+def resolve(benchmark: dict) -> dict:
+    """The benchmark with its actual function, importing its module."""
+    if not isinstance(benchmark["function"], LazyFunction):
+        return benchmark
+    return {**benchmark, "function": benchmark["function"].load()}
+
+
+def module_file(module: str) -> Path | None:
+    spec = importlib.util.find_spec(module)
+    if spec is None or spec.origin is None:
+        return None
+    return Path(spec.origin)
+
+
+def module_digest(source_file: Path) -> str:
+    digest = hashlib.sha256(source_file.read_bytes())
+    digest.update(MATRIX_FILE.read_bytes())
+    return digest.hexdigest()
+
+
+def import_benchmarks(module: str) -> list[dict]:
+    # Any module with a LOCAL_BENCHMARKS list can be used, e.g. one with stub
+    # benchmark functions to exercise the orchestration offline.
+    return list(importlib.import_module(module).LOCAL_BENCHMARKS)
+
+
+def load_index(index_file: Path = INDEX_FILE) -> dict[str, dict]:
+    if not index_file.exists():
+        return {}
+    return json.loads(index_file.read_text())
+
+
+def indexed_benchmarks(module: str, entry: dict, source_file: Path) -> list[dict]:
+    return [
+        {
+            **benchmark,
+            "function": LazyFunction(module, benchmark["function"], str(source_file)),
+        }
+        for benchmark in entry["benchmarks"]
+    ]
+
+
+def load_benchmarks(modules: list[str], use_index: bool = True) -> list[dict]:
+    """The benchmarks of the given modules, from the index when it is up to
+    date with them (their functions are only imported once they run), and
+    by importing them otherwise.
+    """
+    index = load_index() if use_index else {}
+    benchmarks = []
+    for module in modules:
+        entry = index.get(module)
+        source_file = module_file(module) if entry is not None else None
+        if source_file is not None and entry["digest"] == module_digest(source_file):
+            benchmarks.extend(indexed_benchmarks(module, entry, source_file))
+            continue
+
+        if entry is not None:
+            print(
+                f"The index is out of date for {module}, importing it instead "
+                "(regenerate it with `python -m benchmarks.registry`)"
+            )
+        benchmarks.extend(import_benchmarks(module))
+    return benchmarks
+
+
+def index_module(module: str) -> dict:
+    benchmarks = []
+    for benchmark in import_benchmarks(module):
+        function = unwrap(benchmark["function"])
+        if function.__module__ != module:
+            raise ValueError(
+                f"{benchmark['name']} of {module} uses {function.__qualname__} "
+                f"from {function.__module__}, which can't be loaded lazily"
+            )
+
+        benchmarks.append(
+            {
+                **benchmark,
+                "function": function.__name__,
+                # Part of the cache keys, and taken from fal's options otherwise.
+                "requirements": get_requirements(benchmark),
+            }
+        )
+
+    return {
+        "digest": module_digest(module_file(module)),
+        "benchmarks": benchmarks,
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Regenerate the index of the benchmarks (needs all the "
+        "benchmark modules to be importable, i.e. fal to be installed)."
+    )
+    parser.add_argument("modules", nargs="*", default=BENCHMARK_MODULES)
+    parser.add_argument("--index-file", type=Path, default=INDEX_FILE)
+
+    options = parser.parse_args()
+    index = load_index(options.index_file)
+    index.update((module, index_module(module)) for module in options.modules)
+    options.index_file.write_text(json.dumps(index, indent=2) + "\n")
+    print(
+        f"Indexed {sum(len(index[module]['benchmarks']) for module in options.modules)} "
+        f"benchmarks from {len(options.modules)} modules"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import asyncio
+import statistics
+from collections import defaultdict
+from collections.abc import AsyncIterator, Iterable, Sequence
+from contextlib import asynccontextmanager
+from typing import Any
+
+from rich.progress import Progress, SpinnerColumn, TextColumn, TimeElapsedColumn
+
+from benchmarks.session import benchmark_runtime
+
+
+class GpuSlots:
+    """Hands out the GPUs of a node, so that at most one benchmark is running
+    on each of them at any time (co-located benchmarks skew each other's
+    timings).
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._free: asyncio.Queue[int] = asyncio.Queue()
+        for gpu in range(capacity):
+            self._free.put_nowait(gpu)
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[int]:
+        gpu = await self._free.get()
+        try:
+            yield gpu
+        finally:
+            self._free.put_nowait(gpu)
+
+
+def duration_history(results: Iterable[dict]) -> dict[tuple[str, str], list[float]]:
+    # How long each benchmark took in the previous runs, with any parameters
+    # (the end-to-end call when it was recorded, otherwise the part that the
+    # benchmark measured itself).
+    history = defaultdict(list)
+    for result in results:
+        duration = result.get("worker", {}).get("wall_time") or benchmark_runtime(
+            result
+        )
+        history[result["category"], result["name"]].append(duration)
+    return history
+
+
+def longest_first(
+    groups: Sequence[list[Any]],
+    history: dict[tuple[str, str], list[float]],
+) -> list[list[Any]]:
+    """Order the groups by their expected duration, longest first, which
+    keeps the makespan close to optimal when there are more groups than
+    GPUs. Groups with benchmarks that were never run go first, since they
+    might be the longest ones.
+    """
+
+    def expected_duration(group: list[Any]) -> float:
+        total = 0.0
+        for pending in group:
+            category, name, _ = pending.key
+            if not history.get((category, name)):
+                return float("inf")
+            total += statistics.median(history[category, name])
+        return total
+
+    return sorted(groups, key=expected_duration, reverse=True)
+
+
+class BenchmarkProgress:
+    """Live view of a session: one row per benchmark (queued, running along
+    with its elapsed time, done or failed) and an overall one.
+    """
+
+    def __init__(self, total: int) -> None:
+        self.progress = Progress(
+            SpinnerColumn(),
+            TextColumn("{task.description}"),
+            TextColumn("{task.fields[status]}"),
+            TimeElapsedColumn(),
+        )
+        self.overall = self.progress.add_task(
+            "Running benchmarks", total=total, status=""
+        )
+        self.tasks: dict[tuple[str, str, str], Any] = {}
+
+    def __enter__(self) -> BenchmarkProgress:
+        self.progress.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.progress.stop()
+
+    def print(self, *objects: Any) -> None:
+        self.progress.console.print(*objects)
+
+    def add(self, key: tuple[str, str, str], description: str) -> None:
+        self.tasks[key] = self.progress.add_task(
+            description, total=1, start=False, status="queued"
+        )
+
+    def start(self, key: tuple[str, str, str]) -> None:
+        self.progress.start_task(self.tasks[key])
+        self.progress.update(self.tasks[key], status="running")
+
+    def finish(self, key: tuple[str, str, str], status: str) -> None:
+        self.progress.update(self.tasks[key], completed=1, status=status)
+        self.progress.stop_task(self.tasks[key])
+        self.progress.advance(self.overall)
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import ast
+import base64
+import hashlib
+import json
+import os
+from array import array
+from collections import defaultdict
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+from benchmarks.executors import get_requirements
+from benchmarks.instrumentation import FIRST_INFERENCE
+from benchmarks.registry import function_file
+
+
+def parameters_key(parameters: dict) -> str:
+    return json.dumps(parameters, sort_keys=True)
+
+
+PACKAGE_DIR = Path(__file__).parent
+
+
+def imported_files(source_file: Path) -> set[Path]:
+    """Files of the modules of this package that the given file imports."""
+    names = set()
+    for node in ast.walk(ast.parse(source_file.read_text())):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module is not None:
+            # `from benchmarks import settings` imports a module as well.
+            names.add(node.module)
+            names.update(f"{node.module}.{alias.name}" for alias in node.names)
+
+    files = set()
+    for name in names:
+        package, _, module = name.partition(".")
+        module_file = PACKAGE_DIR / f"{module}.py"
+        if package == PACKAGE_DIR.name and module_file.exists():
+            files.add(module_file)
+    return files
+
+
+def runner_files(source_file: Path) -> list[Path]:
+    """The file of a runner and of every module of this package it imports,
+    directly or not (e.g. benchmarks.settings, with the measurement loop).
+    """
+    files = {source_file}
+    pending = [source_file]
+    while pending:
+        for imported_file in imported_files(pending.pop()) - files:
+            files.add(imported_file)
+            pending.append(imported_file)
+    return sorted(files)
+
+
+def runner_digest(function: Any) -> str:
+    # Found from the source rather than from sys.modules, so that it works
+    # for the benchmarks of the index too (without importing their module).
+    digest = hashlib.sha256()
+    for source_file in runner_files(function_file(function)):
+        digest.update(source_file.read_bytes())
+    return digest.hexdigest()
+
+
+def cache_key(benchmark: dict, settings: dict, parameters: dict) -> str:
+    """Content hash of everything that defines a benchmark's results: the
+    source of its runner module (and of every module of this package that it
+    uses), its kwargs and requirements, and the settings and parameters it is
+    run with. Results are only reused when it matches.
+
+    Any change to a runner module (or to one of the modules it uses) re-runs
+    all of its benchmarks, since there is no telling which of them the
+    changed code is used by.
+    """
+    definition = {
+        "runner": runner_digest(benchmark["function"]),
+        "kwargs": benchmark.get("kwargs", {}),
+        "requirements": get_requirements(benchmark),
+        "settings": settings,
+        "parameters": parameters,
+    }
+    return hashlib.sha256(json.dumps(definition, sort_keys=True).encode()).hexdigest()
+
+
+def pack_timings(timings: list[float]) -> str:
+    # Per-step timings add up quickly (steps x iterations x benchmarks), so
+    # they are stored as base64 encoded float32 arrays rather than as lists.
+    return base64.b64encode(array("f", timings).tobytes()).decode()
+
+
+def unpack_timings(packed: str) -> list[float]:
+    timings = array("f")
+    timings.frombytes(base64.b64decode(packed))
+    return timings.tolist()
+
+
+def result_parameters(result: dict, session: dict) -> dict:
+    # Results from before the sweeps don't carry their own parameters, they
+    # were all run with the session-wide ones.
+    return result.get("parameters", session["parameters"])
+
+
+def result_key(result: dict, session: dict) -> tuple[str, str, str]:
+    return (
+        result["category"],
+        result["name"],
+        parameters_key(result_parameters(result, session)),
+    )
+
+
+def benchmark_runtime(result: dict) -> float:
+    # Everything the benchmark function itself measured, i.e. the part of
+    # the call that would be the same on a warm or a cold worker. The first
+    # inference is already counted as the first warmup/timed iteration.
+    setup = sum(
+        timing
+        for stage, timing in result["setup_timings"].items()
+        if stage != FIRST_INFERENCE
+    )
+    iterations = sum(result["warmup_timings"]) + sum(result["timings"])
+    stages = sum(result["stage_timings"].get("total", []))
+    load_test = (result["load_test"] or {}).get("duration", 0.0)
+    return setup + iterations + stages + load_test
+
+
+def base_results(session: dict) -> list[dict]:
+    """Results that were run with the session-wide parameters (i.e. the
+    ones that are not only part of a sweep).
+    """
+    return [
+        result
+        for result in session["timings"]
+        if result_parameters(result, session) == session["parameters"]
+    ]
+
+
+def base_failures(session: dict) -> list[dict]:
+    # Same, for the benchmarks that failed (sessions from before failures
+    # were recorded don't have any).
+    return [
+        failure
+        for failure in session.get("failures", [])
+        if failure["parameters"] == session["parameters"]
+    ]
+
+
+def sweep_results(
+    session: dict,
+    fields: Iterable[str],
+) -> dict[tuple[str, str], list[tuple[dict, dict]]]:
+    """Group the results that only differ from the session-wide parameters
+    on the given fields, as (parameters, result) pairs for each benchmark.
+    Benchmarks that were only run with a single value are left out.
+    """
+    fields = set(fields)
+
+    def without_fields(parameters: dict) -> dict:
+        return {key: value for key, value in parameters.items() if key not in fields}
+
+    base = without_fields(session["parameters"])
+    sweeps = defaultdict(list)
+    for result in session["timings"]:
+        parameters = result_parameters(result, session)
+        if without_fields(parameters) == base:
+            sweeps[(result["category"], result["name"])].append((parameters, result))
+
+    return {key: sweep for key, sweep in sweeps.items() if len(sweep) > 1}
+
+
+class SessionJournal:
+    """Append-only log of the results of a session, written as they complete
+    so that nothing is lost if the orchestrator dies midway. It's compacted
+    into the session file once the session is over.
+    """
+
+    def __init__(self, session_file: Path) -> None:
+        self.path = session_file.with_suffix(".jsonl")
+
+    def start(self, settings: dict) -> list[dict]:
+        """Open the journal and return the results from an interrupted run
+        with the same settings, if there is one.
+        """
+        if self.path.exists():
+            with open(self.path) as stream:
+                header, *entries = map(self._parse, stream.readlines() or [""])
+
+            if header is not None and header.get("settings") == settings:
+                # The last line might be partially written if we crashed while
+                # appending it, so the journal is rewritten without it before
+                # anything else gets appended to it.
+                entries = [entry for entry in entries if entry is not None]
+                self._rewrite([header, *entries])
+                return entries
+
+            print(f"Settings mismatch, discarding the journal at {self.path}")
+
+        self._rewrite([{"settings": settings}])
+        return []
+
+    def append(self, result: dict) -> None:
+        self._write("a", result)
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+    def _write(self, mode: str, entry: dict) -> None:
+        with open(self.path, mode) as stream:
+            stream.write(json.dumps(entry) + "\n")
+            stream.flush()
+            os.fsync(stream.fileno())
+
+    def _rewrite(self, entries: list[dict]) -> None:
+        # Through a temporary file, so that a crash while rewriting it leaves
+        # the previous journal intact.
+        tmp_file = self.path.with_suffix(".jsonl.tmp")
+        with open(tmp_file, "w") as stream:
+            stream.writelines(json.dumps(entry) + "\n" for entry in entries)
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(tmp_file, self.path)
+
+    @staticmethod
+    def _parse(line: str) -> dict | None:
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            return None
+
+
+def write_session(session_file: Path, results: dict) -> None:
+    # Written to a temporary file first, so the previous session file stays
+    # intact if we crash while writing the new one.
+    tmp_file = session_file.with_suffix(".json.tmp")
+    with open(tmp_file, "w") as stream:
+        json.dump(results, stream)
+        stream.write("\n")
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.replace(tmp_file, session_file)
@@ -1,35 +1,241 @@
 from __future__ import annotations
 
+import math
+import statistics
 import time
 from collections.abc import Callable
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any
 
+from benchmarks.compile_cache import CompileCache
+from benchmarks.images import encode_image
+from benchmarks.instrumentation import FIRST_INFERENCE, StageTimer, StepTimer
+from benchmarks.loadtest import LoadTestSettings, run_load_test
+from benchmarks.memory import MemoryCollector
+from benchmarks.profiling import profile_iteration
+from benchmarks.stats import relative_error
+from benchmarks.telemetry import TelemetrySampler, default_backend
+
 
 @dataclass
 class BenchmarkSettings:
     warmup_iterations: int = 3
     benchmark_iterations: int = 10
 
-    def apply(self, test_fn: Callable[[], Any]) -> BenchmarkResults:
-        for _ in range(self.warmup_iterations):
-            test_fn()
+    # When set, warmup_iterations becomes the minimum and the warmup continues
+    # until the last warmup_window iterations are all within the given
+    # relative tolerance of their median (or max_warmup_iterations is hit).
+    # Useful for backends that keep recompiling / re-capturing CUDA graphs.
+    warmup_tolerance: float | None = None
+    warmup_window: int = 3
+    max_warmup_iterations: int = 20
+
+    # When set, benchmark_iterations is ignored and the iterations continue
+    # until the 95% confidence interval of the median is within the given
+    # relative error (e.g. 0.005 for ±0.5%), bounded by min/max_iterations.
+    target_relative_error: float | None = None
+    min_iterations: int = 6
+    max_iterations: int = 50
+
+    # Extra iterations (after the timed ones) where the per-stage timers
+    # are enabled. They are kept separate since the stage boundaries need
+    # device synchronization which would skew the end-to-end timings.
+    stage_iterations: int = 0
+
+    # Whether to run one more iteration, after all the others, under
+    # torch.profiler (see benchmarks.profiling).
+    profile: bool = False
+
+    # Whether to also generate an image from a fixed seed, for the runners
+    # that support it, to compare its fidelity against the reference
+    # implementation (see benchmarks.fidelity).
+    capture_image: bool = False
+
+    # When set, the pipeline is also driven with concurrent requests after
+    # all the other iterations (see benchmarks.loadtest).
+    load_test: LoadTestSettings | None = None
+
+    def __post_init__(self) -> None:
+        # The results (and the first inference in particular) need at least
+        # one timed iteration.
+        if self.target_relative_error is None:
+            if self.benchmark_iterations < 1:
+                raise ValueError("At least one timed iteration is needed")
+        elif not 1 <= self.min_iterations <= self.max_iterations:
+            raise ValueError(
+                "The minimum number of iterations needs to be at least 1, and "
+                "at most the maximum number of iterations"
+            )
 
-        timings = []
-        for _ in range(self.benchmark_iterations):
+    def apply(
+        self,
+        test_fn: Callable[[], Any],
+        stages: StageTimer | None = None,
+        setup: StageTimer | None = None,
+        telemetry: TelemetrySampler | None = None,
+        steps: StepTimer | None = None,
+        compile_cache: CompileCache | None = None,
+        image_fn: Callable[[], Any] | None = None,
+    ) -> BenchmarkResults:
+        if telemetry is None:
+            telemetry = TelemetrySampler(default_backend())
+
+        memory = MemoryCollector()
+        memory.start()
+
+        warmup_timings: list[float] = []
+        while not self._is_warm(warmup_timings):
             t0 = time.perf_counter()
             test_fn()
-            timings.append(time.perf_counter() - t0)
+            warmup_timings.append(time.perf_counter() - t0)
+
+        timings: list[float] = []
+        windows: list[tuple[float, float]] = []
+        telemetry.start()
+        try:
+            while not self._is_done(timings):
+                t0 = time.perf_counter()
+                test_fn()
+                t1 = time.perf_counter()
+                timings.append(t1 - t0)
+                windows.append((t0, t1))
+        finally:
+            telemetry.stop()
+
+        stage_timings: dict[str, list[float]] = {}
+        step_timings: list[list[float]] = []
+        if stages is not None and self.stage_iterations:
+            stages.enabled = True
+            if steps is not None:
+                steps.enabled = True
+            try:
+                for _ in range(self.stage_iterations):
+                    t0 = time.perf_counter()
+                    test_fn()
+                    total = time.perf_counter() - t0
+                    for name, value in {**stages.collect(), "total": total}.items():
+                        stage_timings.setdefault(name, []).append(value)
+                    if steps is not None:
+                        step_timings.append(steps.collect())
+            finally:
+                stages.enabled = False
+                if steps is not None:
+                    steps.enabled = False
+
+        memory_stats = memory.collect()
+        try:
+            load_test = None
+            if self.load_test is not None:
+                load_test = run_load_test(test_fn, self.load_test)
+
+            image = None
+            if self.capture_image and image_fn is not None:
+                image = encode_image(image_fn())
+
+            # Last, so that the profiler's overhead can't leak into any of the
+            # other measurements.
+            profile = profile_iteration(test_fn) if self.profile else None
+        finally:
+            memory.finish()
+
+        setup_timings = setup.collect() if setup is not None else {}
+        setup_timings[FIRST_INFERENCE] = (warmup_timings + timings)[0]
 
-        return BenchmarkResults(timings=timings)
+        error = relative_error(timings)
+        return BenchmarkResults(
+            timings=timings,
+            setup_timings=setup_timings,
+            relative_error=error if math.isfinite(error) else None,
+            warmup_timings=warmup_timings,
+            stage_timings=stage_timings,
+            memory=memory_stats,
+            load_test=load_test,
+            telemetry=telemetry.summary(windows),
+            step_timings=step_timings,
+            profile=profile,
+            compile_cache=compile_cache.report() if compile_cache else None,
+            image=image,
+        )
+
+    def _is_warm(self, timings: list[float]) -> bool:
+        if len(timings) < self.warmup_iterations:
+            return False
+        elif self.warmup_tolerance is None:
+            return True
+        elif len(timings) >= self.max_warmup_iterations:
+            return True
+        elif len(timings) < self.warmup_window:
+            return False
+
+        window = timings[-self.warmup_window :]
+        median = statistics.median(window)
+        return all(
+            abs(timing - median) <= self.warmup_tolerance * median for timing in window
+        )
+
+    def _is_done(self, timings: list[float]) -> bool:
+        if self.target_relative_error is None:
+            return len(timings) >= self.benchmark_iterations
+
+        if len(timings) < self.min_iterations:
+            return False
+        elif len(timings) >= self.max_iterations:
+            return True
+        return relative_error(timings) <= self.target_relative_error
 
 
 @dataclass
 class BenchmarkResults:
     timings: list[float]
 
+    # Relative half-width of the median's 95% confidence interval, or None
+    # if there weren't enough iterations to compute it.
+    relative_error: float | None = None
+
+    # Time of each warmup iteration, in order.
+    warmup_timings: list[float] = field(default_factory=list)
+
+    # Cold start breakdown (see benchmarks.instrumentation.SETUP_STAGES).
+    setup_timings: dict[str, float] = field(default_factory=dict)
+
+    # Per-stage wall time (see benchmarks.instrumentation) for each of the
+    # stage iterations, along with their end-to-end "total".
+    stage_timings: dict[str, list[float]] = field(default_factory=dict)
+
+    # Time of each denoising step, for each of the stage iterations.
+    step_timings: list[list[float]] = field(default_factory=list)
+
+    # Peak device/host memory, in bytes (see benchmarks.memory).
+    memory: dict[str, int] = field(default_factory=dict)
+
+    # Latency percentiles, queueing delay and throughput under load, if a
+    # load test was requested.
+    load_test: dict[str, Any] | None = None
+
+    # GPU clocks, temperature, power and utilization during the timed
+    # iterations, along with the ones that ran on a throttled or shared GPU
+    # (see benchmarks.telemetry).
+    telemetry: dict[str, Any] | None = None
+
+    # Chrome trace and top operators of the profiled iteration, if any.
+    profile: dict[str, Any] | None = None
+
+    # Whether the compiled artifacts were already cached (see
+    # benchmarks.compile_cache), or None for the backends that don't compile.
+    compile_cache: dict[str, Any] | None = None
+
+    # PNG (base64 encoded) generated from benchmarks.images.IMAGE_SEED, if
+    # requested and supported by the runner.
+    image: str | None = None
+
 
 @dataclass
 class InputParameters:
     prompt: str = "A photo of a cat"
     steps: int = 50
+    batch_size: int = 1
+
+    # Defaults to the native resolution of each model (512x512 for SD1.5
+    # and 1024x1024 for SDXL).
+    width: int | None = None
+    height: int | None = None
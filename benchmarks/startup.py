@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+from rich.console import Console
+from rich.table import Table
+
+from benchmarks.stats import bootstrap_median_interval
+
+# Listing the benchmarks is all the CLI does before it either dispatches them
+# or finds their previous results, so it is what the index speeds up.
+COMMANDS = {
+    "index": [sys.executable, "-m", "benchmarks", "list"],
+    "eager imports": [sys.executable, "-m", "benchmarks", "list", "--no-index"],
+}
+
+
+def time_command(command: list[str]) -> float:
+    t0 = time.perf_counter()
+    process = subprocess.run(command, capture_output=True, text=True)
+    elapsed = time.perf_counter() - t0
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed:\n{process.stderr}")
+    return elapsed
+
+
+def main() -> None:
+    parser = ArgumentParser(
+        description="Measure the startup time of the CLI with the benchmark "
+        "index, against importing all the benchmark modules (which needs fal)."
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--warmup-runs", type=int, default=2)
+
+    options = parser.parse_args()
+    timings = {}
+    for label, command in COMMANDS.items():
+        # The first runs also pay for (re)compiling the bytecode and for the
+        # cold file system cache.
+        for _ in range(options.warmup_runs):
+            time_command(command)
+        timings[label] = [time_command(command) for _ in range(options.runs)]
+
+    table = Table("Startup", "Median (s)", "95% CI (s)", "Speedup")
+    baseline = statistics.median(timings["eager imports"])
+    for label, samples in timings.items():
+        median = statistics.median(samples)
+        low, high = bootstrap_median_interval(samples)
+        table.add_row(
+            label,
+            f"{median:.3f}",
+            f"{low:.3f} - {high:.3f}",
+            f"{baseline / median:.1f}x",
+        )
+
+    with Console() as console:
+        console.print(table)
+
+
+if __name__ == "__main__":
+    main()
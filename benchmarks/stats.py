@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import math
+import random
+import statistics
+from collections.abc import Sequence
+
+
+def median_confidence_interval(
+    samples: Sequence[float],
+    confidence: float = 0.95,
+) -> tuple[float, float] | None:
+    """Distribution-free confidence interval of the median, built from the
+    order statistics of the samples. Returns None when there are too few
+    samples to reach the requested confidence (e.g. less than 6 for 95%).
+    """
+    n = len(samples)
+    alpha = (1 - confidence) / 2
+
+    # The largest rank j such that P(Binomial(n, 1/2) < j) <= alpha; the
+    # interval is then [x_(j), x_(n - j + 1)].
+    rank = 0
+    cumulative = 0.0
+    for k in range(n):
+        cumulative += math.comb(n, k) / 2**n
+        if cumulative > alpha:
+            break
+        rank = k + 1
+
+    if rank == 0:
+        return None
+
+    ordered = sorted(samples)
+    return ordered[rank - 1], ordered[n - rank]
+
+
+def relative_error(samples: Sequence[float], confidence: float = 0.95) -> float:
+    """Half-width of the median's confidence interval, relative to the
+    median itself. Infinite when the interval can't be computed yet.
+    """
+    interval = median_confidence_interval(samples, confidence)
+    if interval is None:
+        return math.inf
+
+    low, high = interval
+    return (high - low) / 2 / statistics.median(samples)
+
+
+def percentiles(
+    samples: Sequence[float],
+    points: Sequence[int] = (50, 95, 99),
+) -> dict[str, float]:
+    """Percentiles of the samples (interpolated), keyed as p50, p95, etc."""
+    if len(samples) == 1:
+        return {f"p{point}": samples[0] for point in points}
+
+    cut_points = statistics.quantiles(samples, n=100, method="inclusive")
+    return {f"p{point}": cut_points[point - 1] for point in points}
+
+
+def bootstrap_median_interval(
+    samples: Sequence[float],
+    confidence: float = 0.95,
+    resamples: int = 5000,
+    seed: int = 0,
+) -> tuple[float, float]:
+    """Percentile bootstrap confidence interval of the median. Unlike
+    median_confidence_interval it works with any number of samples, at the
+    cost of being optimistic for the very small ones. It is seeded so that
+    the same sessions always compare the same way.
+    """
+    if len(samples) == 1:
+        return samples[0], samples[0]
+
+    rng = random.Random(seed)
+    medians = sorted(
+        statistics.median(rng.choices(samples, k=len(samples)))
+        for _ in range(resamples)
+    )
+    alpha = (1 - confidence) / 2
+    low = medians[int(alpha * (resamples - 1))]
+    high = medians[math.ceil((1 - alpha) * (resamples - 1))]
+    return low, high
+
+
+def mann_whitney_u(a: Sequence[float], b: Sequence[float]) -> float:
+    """Two-sided p-value of the Mann-Whitney U test, i.e. how likely it is
+    to see samples this far apart if both come from the same distribution.
+
+    The exact distribution of U is used for small samples without ties (the
+    usual case for timings) and the normal approximation otherwise.
+    """
+    n1, n2 = len(a), len(b)
+    if not n1 or not n2:
+        return 1.0
+
+    # Mid-ranks of the pooled samples, averaging the ranks of the ties.
+    pooled = sorted([(value, 0) for value in a] + [(value, 1) for value in b])
+    ranks = [0.0] * len(pooled)
+    tie_groups = []
+    start = 0
+    while start < len(pooled):
+        end = start
+        while end + 1 < len(pooled) and pooled[end + 1][0] == pooled[start][0]:
+            end += 1
+        for index in range(start, end + 1):
+            ranks[index] = (start + end) / 2 + 1
+        tie_groups.append(end - start + 1)
+        start = end + 1
+
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, pooled) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    u = min(u, n1 * n2 - u)
+    has_ties = any(size > 1 for size in tie_groups)
+
+    if not has_ties and n1 + n2 <= 50:
+        counts = _u_distribution(n1, n2)
+        p = 2 * sum(counts[: int(u) + 1]) / math.comb(n1 + n2, n1)
+        return min(p, 1.0)
+
+    n = n1 + n2
+    tie_correction = sum(size**3 - size for size in tie_groups) / (n * (n - 1))
+    sigma = math.sqrt(n1 * n2 / 12 * (n + 1 - tie_correction))
+    if sigma == 0:
+        return 1.0
+
+    # With continuity correction; u is the lower tail so z <= 0.
+    z = (u - n1 * n2 / 2 + 0.5) / sigma
+    return min(math.erfc(-z / math.sqrt(2)), 1.0)
+
+
+def _u_distribution(n1: int, n2: int) -> list[int]:
+    """Number of arrangements of the two samples for each value of U."""
+    # counts[m][u] for the first sample of size m, built up one element of the
+    # second sample at a time.
+    counts = [[1] + [0] * (n1 * n2) for _ in range(n1 + 1)]
+    for n in range(1, n2 + 1):
+        for m in range(1, n1 + 1):
+            row = counts[m]
+            for u in range(n1 * n2, n - 1, -1):
+                row[u] += counts[m - 1][u - n]
+    return counts[n1]
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import time
+from collections import Counter
+
+from benchmarks.settings import BenchmarkResults, BenchmarkSettings, InputParameters
+
+# Calls of each flaky benchmark so far, in this process.
+_attempts: Counter[str] = Counter()
+
+
+def sleepy(
+    benchmark_settings: BenchmarkSettings,
+    parameters: InputParameters,
+    latency: float,
+) -> BenchmarkResults:
+    # Sleeps as long as a pipeline with the given latency (for 50 steps)
+    # would take, without a GPU or any of the backends.
+    return benchmark_settings.apply(lambda: time.sleep(latency * parameters.steps / 50))
+
+
+def flaky(
+    benchmark_settings: BenchmarkSettings,
+    parameters: InputParameters,
+    name: str,
+    failures: int,
+) -> BenchmarkResults:
+    # Fails with a transient error (see benchmarks.failures) the first
+    # `failures` times it is called, like a worker running out of memory.
+    _attempts[name] += 1
+    if _attempts[name] <= failures:
+        raise MemoryError("CUDA out of memory. Tried to allocate 2.00 GiB")
+    return sleepy(benchmark_settings, parameters, latency=0.01)
+
+
+# Stub benchmarks to exercise the orchestration offline, e.g. with
+# `--executor in-process --benchmark-module benchmarks.stub`.
+LOCAL_BENCHMARKS = [
+    {
+        "name": "Stub (fast)",
+        "category": "Stub",
+        "function": sleepy,
+        "kwargs": {"latency": 0.01},
+    },
+    {
+        "name": "Stub (slow)",
+        "category": "Stub",
+        "function": sleepy,
+        "kwargs": {"latency": 0.03},
+    },
+    {
+        "name": "Stub (flaky)",
+        "category": "Stub",
+        "function": flaky,
+        "kwargs": {"name": "flaky", "failures": 1},
+    },
+]
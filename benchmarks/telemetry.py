@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import os
+import statistics
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Protocol
+
+
+@dataclass
+class TelemetrySample:
+    time: float
+    sm_clock: int  # MHz
+    memory_clock: int  # MHz
+    temperature: int  # Celsius
+    power: float  # Watts
+    utilization: int  # %
+
+    # Whether the clocks were held back by thermal limits or hardware
+    # slowdowns.
+    throttled: bool = False
+
+    # Whether the clocks were held back by the power limit. This is how a
+    # power-capped GPU normally runs at full load, so it is reported on its
+    # own rather than as throttling.
+    power_capped: bool = False
+
+    # Processes other than us that are using the GPU.
+    foreign_processes: int = 0
+
+
+class TelemetryBackend(Protocol):
+    def sample(self) -> TelemetrySample:
+        ...
+
+
+class NvmlBackend:
+    """Samples the GPU that the benchmark runs on through NVML."""
+
+    def __init__(self) -> None:
+        import pynvml
+
+        pynvml.nvmlInit()
+        self.nvml = pynvml
+
+        # NVML doesn't know about CUDA_VISIBLE_DEVICES, which is how the
+        # local executors assign GPUs to the benchmarks.
+        visible_devices = os.environ.get("CUDA_VISIBLE_DEVICES", "0")
+        index = visible_devices.split(",")[0]
+        self.handle = pynvml.nvmlDeviceGetHandleByIndex(
+            int(index) if index.isdigit() else 0
+        )
+        self.throttle_reasons = (
+            pynvml.nvmlClocksThrottleReasonHwSlowdown
+            | pynvml.nvmlClocksThrottleReasonSwThermalSlowdown
+            | pynvml.nvmlClocksThrottleReasonHwThermalSlowdown
+            | pynvml.nvmlClocksThrottleReasonHwPowerBrakeSlowdown
+        )
+
+    def sample(self) -> TelemetrySample:
+        nvml, handle = self.nvml, self.handle
+        processes = nvml.nvmlDeviceGetComputeRunningProcesses(handle)
+        throttle_reasons = nvml.nvmlDeviceGetCurrentClocksThrottleReasons(handle)
+        return TelemetrySample(
+            time=time.perf_counter(),
+            sm_clock=nvml.nvmlDeviceGetClockInfo(handle, nvml.NVML_CLOCK_SM),
+            memory_clock=nvml.nvmlDeviceGetClockInfo(handle, nvml.NVML_CLOCK_MEM),
+            temperature=nvml.nvmlDeviceGetTemperature(
+                handle, nvml.NVML_TEMPERATURE_GPU
+            ),
+            power=nvml.nvmlDeviceGetPowerUsage(handle) / 1000,
+            utilization=nvml.nvmlDeviceGetUtilizationRates(handle).gpu,
+            throttled=bool(throttle_reasons & self.throttle_reasons),
+            power_capped=bool(
+                throttle_reasons & nvml.nvmlClocksThrottleReasonSwPowerCap
+            ),
+            foreign_processes=count_foreign_processes(
+                [process.pid for process in processes]
+            ),
+        )
+
+
+def count_foreign_processes(pids: list[int]) -> int:
+    # NVML reports the PIDs of the host's namespace, so inside a container
+    # (like the fal workers) our own process is listed under another PID and
+    # can't be told apart by it. The GPU is only sampled during the timed
+    # iterations, when the benchmark holds a CUDA context, so one of the
+    # processes is always ours, whichever PID it is listed under.
+    return max(len(pids) - 1, 0)
+
+
+def default_backend() -> TelemetryBackend | None:
+    try:
+        return NvmlBackend()
+    except Exception:
+        # No NVML bindings or no NVIDIA driver/GPU, e.g. on CPU-only runs.
+        return None
+
+
+class TelemetrySampler:
+    """Samples the GPU at a fixed rate from a background thread while the
+    benchmark is timed, so that the iterations that ran on a throttled (or
+    shared) GPU can be told apart.
+    """
+
+    def __init__(
+        self,
+        backend: TelemetryBackend | None = None,
+        interval: float = 0.1,
+    ) -> None:
+        self.backend = backend
+        self.interval = interval
+        self.samples: list[TelemetrySample] = []
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self.backend is None:
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        assert self.backend is not None
+        while True:
+            self.samples.append(self.backend.sample())
+            if self._stopped.wait(self.interval):
+                return
+
+    def flag(self, windows: list[tuple[float, float]]) -> list[int]:
+        """Indices of the (start, end) windows that overlap with a sample where
+        the GPU was throttled or used by another process.
+        """
+        disturbed = [
+            sample.time
+            for sample in self.samples
+            if sample.throttled or sample.foreign_processes
+        ]
+        return [
+            index
+            for index, (start, end) in enumerate(windows)
+            if any(start <= sample_time <= end for sample_time in disturbed)
+        ]
+
+    def summary(self, windows: list[tuple[float, float]]) -> dict[str, Any] | None:
+        if not self.samples:
+            return None
+
+        samples = self.samples
+        return {
+            "samples": len(samples),
+            "sm_clock": {
+                "median": statistics.median(sample.sm_clock for sample in samples),
+                "min": min(sample.sm_clock for sample in samples),
+            },
+            "memory_clock": statistics.median(
+                sample.memory_clock for sample in samples
+            ),
+            "max_temperature": max(sample.temperature for sample in samples),
+            "mean_power": statistics.mean(sample.power for sample in samples),
+            "mean_utilization": statistics.mean(
+                sample.utilization for sample in samples
+            ),
+            "throttled_fraction": sum(sample.throttled for sample in samples)
+            / len(samples),
+            "power_capped_fraction": sum(sample.power_capped for sample in samples)
+            / len(samples),
+            "max_foreign_processes": max(
+                sample.foreign_processes for sample in samples
+            ),
+            "flagged_iterations": self.flag(windows),
+        }
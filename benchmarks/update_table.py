@@ -4,6 +4,19 @@ from argparse import ArgumentParser
 from collections import defaultdict
 from pathlib import Path
 
+from benchmarks.fidelity import pareto_frontier
+from benchmarks.instrumentation import SETUP_STAGES, STAGES
+from benchmarks.loadtest import OPEN_LOOP
+from benchmarks.memory import MEMORY_KEYS, PEAK_RESERVED
+from benchmarks.session import (
+    base_failures,
+    base_results,
+    result_parameters,
+    sweep_results,
+    unpack_timings,
+)
+from benchmarks.stats import percentiles
+
 README_PATH = Path(__file__).parent.parent / "README.md"
 TABLE_HEADER = (
     "|                  | mean (s) | median (s) | min (s) | max (s) | speed (it/s) |\n"
@@ -15,10 +28,420 @@ TABLE_ROW_FORMAT = (
     "| {name:16} | {mean:7.3f}s | {median:9.3f}s "
     "| {min:6.3f}s | {max:6.3f}s | {speed:7.2f} it/s |\n"
 )
+FAILED_ROW_FORMAT = "| {name:16} | failed ({error}) | | | | |\n"
+STAGES_TABLE_HEADER = (
+    "|                  | text encoder (s) | unet (s) | vae decode (s) | other (s) |\n"
+)
+STAGES_TABLE_DIVIDER = (
+    "|------------------|------------------|----------|----------------|-----------|\n"
+)
+STAGES_TABLE_ROW_FORMAT = (
+    "| {name:16} | {text_encoder:15.3f}s | {unet:7.3f}s "
+    "| {vae_decode:13.3f}s | {other:8.3f}s |\n"
+)
+COLD_START_TABLE_HEADER = (
+    "|                  | load (s) | to device (s) | compile (s) "
+    "| first inference (s) | to first image (s) | warmup (s) | compile cache |\n"
+)
+COLD_START_TABLE_DIVIDER = (
+    "|------------------|----------|---------------|-------------"
+    "|---------------------|--------------------|------------|---------------|\n"
+)
+COLD_START_TABLE_ROW_FORMAT = (
+    "| {name:16} | {load:7.3f}s | {to_device:12.3f}s | {compile:10.3f}s "
+    "| {first_inference:18.3f}s | {total:17.3f}s | {warmup:9.3f}s "
+    "| {compile_cache:>13} |\n"
+)
+THROUGHPUT_TABLE_HEADER = (
+    "|                  | batch size | latency (s) | per image (s) | images/s |\n"
+)
+THROUGHPUT_TABLE_DIVIDER = (
+    "|------------------|------------|-------------|---------------|----------|\n"
+)
+THROUGHPUT_TABLE_ROW_FORMAT = (
+    "| {name:16} | {batch_size:10} | {latency:10.3f}s "
+    "| {per_image:12.3f}s | {throughput:8.2f} |\n"
+)
+RESOLUTION_TABLE_HEADER = (
+    "|                  | resolution | megapixels | latency (s) | per megapixel (s) |\n"
+)
+RESOLUTION_TABLE_DIVIDER = (
+    "|------------------|------------|------------|-------------|-------------------|\n"
+)
+RESOLUTION_TABLE_ROW_FORMAT = (
+    "| {name:16} | {resolution:>10} | {megapixels:10.2f} "
+    "| {latency:10.3f}s | {per_megapixel:16.3f}s |\n"
+)
+STEP_SCALING_TABLE_HEADER = (
+    "|                  | steps | fixed overhead (s) | per step (s) | speed (it/s) |\n"
+)
+STEP_SCALING_TABLE_DIVIDER = (
+    "|------------------|-------|--------------------|--------------|--------------|\n"
+)
+STEP_SCALING_TABLE_ROW_FORMAT = (
+    "| {name:16} | {steps:>5} | {fixed:17.3f}s | {per_step:>12} | {speed:>12} |\n"
+)
+LOAD_TEST_TABLE_HEADER = (
+    "|                  | load | throughput (images/s) | p50 (s) | p95 (s) | p99 (s) "
+    "| p95 queueing (s) |\n"
+)
+LOAD_TEST_TABLE_DIVIDER = (
+    "|------------------|------|-----------------------|---------|---------|---------"
+    "|------------------|\n"
+)
+LOAD_TEST_TABLE_ROW_FORMAT = (
+    "| {name:16} | {load} | {throughput:21.2f} | {p50:6.3f}s | {p95:6.3f}s "
+    "| {p99:6.3f}s | {queue_delay:15.3f}s |\n"
+)
+MEMORY_TABLE_HEADER = (
+    "|                  | model (GiB) | peak allocated (GiB) | peak reserved (GiB) "
+    "| device used at end (GiB) | host peak RSS (GiB) |\n"
+)
+MEMORY_TABLE_DIVIDER = (
+    "|------------------|-------------|----------------------|---------------------"
+    "|--------------------------|---------------------|\n"
+)
+MEMORY_TABLE_ROW_FORMAT = (
+    "| {name:16} | {device_model_resident:>11} | {device_peak_allocated:>20} "
+    "| {device_peak_reserved:>19} | {device_used_at_end:>24} | {host_peak_rss:>19} |\n"
+)
+STEPS_TABLE_HEADER = (
+    "|                  | first step (s) | steady p50 (s) | steady p90 (s) "
+    "| steady p99 (s) | first / steady |\n"
+)
+STEPS_TABLE_DIVIDER = (
+    "|------------------|----------------|----------------|----------------"
+    "|----------------|----------------|\n"
+)
+STEPS_TABLE_ROW_FORMAT = (
+    "| {name:16} | {first:13.4f}s | {p50:13.4f}s | {p90:13.4f}s "
+    "| {p99:13.4f}s | {ratio:13.1f}x |\n"
+)
+FIDELITY_TABLE_HEADER = (
+    "|                  | median (s) | PSNR (dB) |  SSIM  | LPIPS | Pareto optimal |\n"
+)
+FIDELITY_TABLE_DIVIDER = (
+    "|------------------|------------|-----------|--------|-------|----------------|\n"
+)
+FIDELITY_TABLE_ROW_FORMAT = (
+    "| {name:16} | {median:9.3f}s | {psnr:>9} | {ssim:6.4f} | {lpips:>5} "
+    "| {optimal:>14} |\n"
+)
 START_MARKER = "<!-- START TABLE -->\n"
 END_MARKER = "<!-- END TABLE -->\n"
 
 
+def format_stages_row(name: str, stage_timings: dict[str, list[float]]) -> str:
+    # Everything that isn't covered by one of the stages (scheduler steps,
+    # image post-processing, Python glue, etc.) is accounted as "other".
+    medians = {
+        stage: statistics.median(stage_timings.get(stage, [0.0])) for stage in STAGES
+    }
+    other = statistics.median(
+        total
+        - sum(stage_timings[stage][index] for stage in STAGES if stage in stage_timings)
+        for index, total in enumerate(stage_timings["total"])
+    )
+    return STAGES_TABLE_ROW_FORMAT.format(name=name, other=other, **medians)
+
+
+def format_cold_start_row(
+    name: str,
+    setup_timings: dict[str, float],
+    warmup_timings: list[float],
+    compile_cache: dict | None,
+) -> str:
+    # The warmup covers the first inference too, and all the iterations until
+    # the timings are stable (which, for compiled backends, is where most of the
+    # compilation actually happens).
+    setup = {stage: setup_timings.get(stage, 0.0) for stage in SETUP_STAGES}
+    # Backends that don't compile anything (or results from before the
+    # compile cache) don't have one.
+    if compile_cache is None:
+        cache_status = "-"
+    else:
+        cache_status = "hit" if compile_cache["hit"] else "miss"
+    return COLD_START_TABLE_ROW_FORMAT.format(
+        name=name,
+        total=sum(setup.values()),
+        warmup=sum(warmup_timings),
+        compile_cache=cache_status,
+        **setup,
+    )
+
+
+def build_stages_tables(results: dict) -> dict[str, list[str]]:
+    all_rows = defaultdict(list)
+    for timing in sorted(
+        base_results(results),
+        key=lambda timing: statistics.mean(timing["timings"]),
+        reverse=True,
+    ):
+        if timing.get("stage_timings"):
+            all_rows[timing["category"]].append(
+                format_stages_row(timing["name"], timing["stage_timings"])
+            )
+    return all_rows
+
+
+def build_cold_start_tables(results: dict) -> dict[str, list[str]]:
+    all_rows = defaultdict(list)
+    for timing in sorted(
+        base_results(results),
+        key=lambda timing: sum(timing.get("setup_timings", {}).values()),
+        reverse=True,
+    ):
+        if timing.get("setup_timings"):
+            all_rows[timing["category"]].append(
+                format_cold_start_row(
+                    timing["name"],
+                    timing["setup_timings"],
+                    timing.get("warmup_timings", []),
+                    timing.get("compile_cache"),
+                )
+            )
+    return all_rows
+
+
+def build_throughput_tables(results: dict) -> dict[str, list[str]]:
+    all_rows = defaultdict(list)
+    for (category, name), sweep in sorted(
+        sweep_results(results, ["batch_size"]).items()
+    ):
+        for parameters, timing in sorted(
+            sweep, key=lambda kv: kv[0].get("batch_size", 1)
+        ):
+            batch_size = parameters.get("batch_size", 1)
+            latency = statistics.median(timing["timings"])
+            all_rows[category].append(
+                THROUGHPUT_TABLE_ROW_FORMAT.format(
+                    name=name,
+                    batch_size=batch_size,
+                    latency=latency,
+                    per_image=latency / batch_size,
+                    throughput=batch_size / latency,
+                )
+            )
+    return all_rows
+
+
+def build_resolution_tables(results: dict) -> dict[str, list[str]]:
+    all_rows = defaultdict(list)
+    for (category, name), sweep in sorted(
+        sweep_results(results, ["width", "height"]).items()
+    ):
+        # Runs with the native resolution (no explicit width/height) can't be
+        # placed on the curve, so only the explicit ones are rendered.
+        sized_sweep = [
+            (parameters, timing)
+            for parameters, timing in sweep
+            if parameters.get("width") and parameters.get("height")
+        ]
+        for parameters, timing in sorted(
+            sized_sweep, key=lambda kv: kv[0]["width"] * kv[0]["height"]
+        ):
+            megapixels = parameters["width"] * parameters["height"] / 1e6
+            latency = statistics.median(timing["timings"])
+            all_rows[category].append(
+                RESOLUTION_TABLE_ROW_FORMAT.format(
+                    name=name,
+                    resolution=f"{parameters['width']}x{parameters['height']}",
+                    megapixels=megapixels,
+                    latency=latency,
+                    per_megapixel=latency / megapixels,
+                )
+            )
+    return all_rows
+
+
+def build_step_scaling_tables(results: dict) -> dict[str, list[str]]:
+    # Fits latency = fixed + per_step * steps, which separates the one-time
+    # costs (text encoding, VAE decode, Python glue) from the denoising loop.
+    all_rows = defaultdict(list)
+    for (category, name), sweep in sorted(sweep_results(results, ["steps"]).items()):
+        steps = [parameters["steps"] for parameters, _ in sweep]
+        latencies = [statistics.median(timing["timings"]) for _, timing in sweep]
+        per_step, fixed = statistics.linear_regression(steps, latencies)
+        all_rows[category].append(
+            STEP_SCALING_TABLE_ROW_FORMAT.format(
+                name=name,
+                steps=f"{min(steps)}-{max(steps)}",
+                fixed=fixed,
+                # A flat (or noisy) sweep can fit a slope that isn't positive,
+                # which has no meaningful speed.
+                per_step=f"{per_step:.4f}s" if per_step > 0 else "N/A",
+                speed=f"{1 / per_step:.2f} it/s" if per_step > 0 else "N/A",
+            )
+        )
+    return all_rows
+
+
+def build_load_test_tables(results: dict) -> dict[str, list[str]]:
+    all_rows = defaultdict(list)
+    for timing in sorted(
+        base_results(results),
+        key=lambda timing: (timing.get("load_test") or {}).get("throughput", 0),
+    ):
+        if not (load_test := timing.get("load_test")):
+            continue
+
+        load_settings = load_test["settings"]
+        if load_settings["mode"] == OPEN_LOOP:
+            load = f"{load_settings['qps']} qps"
+        else:
+            load = f"{load_settings['concurrency']} clients"
+
+        all_rows[timing["category"]].append(
+            LOAD_TEST_TABLE_ROW_FORMAT.format(
+                name=timing["name"],
+                load=load,
+                # Each request produces a full batch.
+                throughput=load_test["throughput"]
+                * result_parameters(timing, results).get("batch_size", 1),
+                queue_delay=load_test["queue_delay"]["p95"],
+                **load_test["latency"],
+            )
+        )
+    return all_rows
+
+
+def build_steps_tables(results: dict) -> dict[str, list[str]]:
+    # The first step is kept apart from the rest (steady state) since it
+    # carries one-time costs like graph capture or autotuning.
+    rows = []
+    for timing in base_results(results):
+        all_steps = [
+            unpack_timings(packed) for packed in timing.get("step_timings", [])
+        ]
+        if not (all_steps := [steps for steps in all_steps if len(steps) > 1]):
+            continue
+
+        first = statistics.median(steps[0] for steps in all_steps)
+        steady = percentiles(
+            [step for steps in all_steps for step in steps[1:]], points=(50, 90, 99)
+        )
+        rows.append((timing, first, steady))
+
+    all_rows = defaultdict(list)
+    for timing, first, steady in sorted(rows, key=lambda row: -row[2]["p50"]):
+        all_rows[timing["category"]].append(
+            STEPS_TABLE_ROW_FORMAT.format(
+                name=timing["name"],
+                first=first,
+                ratio=first / steady["p50"],
+                **steady,
+            )
+        )
+    return all_rows
+
+
+def build_fidelity_tables(results: dict) -> dict[str, list[str]]:
+    # Against the reference implementation of each category, see
+    # benchmarks.fidelity. The Pareto optimal benchmarks are the ones that
+    # no other is both faster and more faithful (by SSIM) than.
+    points = defaultdict(dict)
+    for timing in base_results(results):
+        if fidelity := timing.get("fidelity"):
+            points[timing["category"]][timing["name"]] = (
+                statistics.median(timing["timings"]),
+                fidelity["ssim"],
+                fidelity,
+            )
+
+    all_rows = defaultdict(list)
+    for category, category_points in points.items():
+        frontier = pareto_frontier(
+            {name: point[:2] for name, point in category_points.items()}
+        )
+        for name, (median, _, fidelity) in sorted(
+            category_points.items(), key=lambda kv: kv[1][0], reverse=True
+        ):
+            all_rows[category].append(
+                FIDELITY_TABLE_ROW_FORMAT.format(
+                    name=name,
+                    median=median,
+                    psnr=(
+                        "identical"
+                        if fidelity["psnr"] is None
+                        else f"{fidelity['psnr']:.2f}"
+                    ),
+                    ssim=fidelity["ssim"],
+                    lpips=(
+                        "N/A"
+                        if fidelity["lpips"] is None
+                        else f"{fidelity['lpips']:.3f}"
+                    ),
+                    optimal="yes" if name in frontier else "",
+                )
+            )
+    return all_rows
+
+
+def format_gib(value: int | None) -> str:
+    return "N/A" if value is None else f"{value / 2**30:.2f}"
+
+
+def build_memory_tables(results: dict) -> dict[str, list[str]]:
+    all_rows = defaultdict(list)
+    for timing in sorted(
+        base_results(results),
+        key=lambda timing: (timing.get("memory") or {}).get(PEAK_RESERVED, 0),
+        reverse=True,
+    ):
+        if memory := timing.get("memory"):
+            all_rows[timing["category"]].append(
+                MEMORY_TABLE_ROW_FORMAT.format(
+                    name=timing["name"],
+                    **{key: format_gib(memory.get(key)) for key in MEMORY_KEYS},
+                )
+            )
+    return all_rows
+
+
+# Secondary tables, rendered under the main table of each category.
+DETAIL_TABLES = [
+    ("Breakdown", STAGES_TABLE_HEADER, STAGES_TABLE_DIVIDER, build_stages_tables),
+    (
+        "Denoising Steps",
+        STEPS_TABLE_HEADER,
+        STEPS_TABLE_DIVIDER,
+        build_steps_tables,
+    ),
+    ("Fidelity", FIDELITY_TABLE_HEADER, FIDELITY_TABLE_DIVIDER, build_fidelity_tables),
+    (
+        "Cold Start",
+        COLD_START_TABLE_HEADER,
+        COLD_START_TABLE_DIVIDER,
+        build_cold_start_tables,
+    ),
+    (
+        "Throughput",
+        THROUGHPUT_TABLE_HEADER,
+        THROUGHPUT_TABLE_DIVIDER,
+        build_throughput_tables,
+    ),
+    (
+        "Resolution Scaling",
+        RESOLUTION_TABLE_HEADER,
+        RESOLUTION_TABLE_DIVIDER,
+        build_resolution_tables,
+    ),
+    (
+        "Step Scaling",
+        STEP_SCALING_TABLE_HEADER,
+        STEP_SCALING_TABLE_DIVIDER,
+        build_step_scaling_tables,
+    ),
+    (
+        "Under Load",
+        LOAD_TEST_TABLE_HEADER,
+        LOAD_TEST_TABLE_DIVIDER,
+        build_load_test_tables,
+    ),
+    ("Memory", MEMORY_TABLE_HEADER, MEMORY_TABLE_DIVIDER, build_memory_tables),
+]
+
+
 def main():
     parser = ArgumentParser()
     parser.add_argument("results_file", type=Path)
@@ -34,7 +457,7 @@ def main():
     all_rows = defaultdict(list)
     steps = results["parameters"]["steps"]
     for timing in sorted(
-        results["timings"],
+        base_results(results),
         key=lambda timing: statistics.mean(timing["timings"]),
         reverse=True,
     ):
@@ -50,6 +473,19 @@ def main():
         )
         all_rows[timing["category"]].append(row)
 
+    # Failed benchmarks are kept in the table (at the bottom), rather than
+    # silently dropping their rows.
+    for failure in base_failures(results):
+        error_type = failure["error"]["type"].rsplit(".", 1)[-1]
+        all_rows[failure["category"]].append(
+            FAILED_ROW_FORMAT.format(name=failure["name"], error=error_type)
+        )
+
+    detail_tables = [
+        (title, header, divider, build_tables(results))
+        for title, header, divider, build_tables in DETAIL_TABLES
+    ]
+
     tables = []
     for category, rows in sorted(all_rows.items(), key=lambda kv: kv[0]):
         tables.append(f"### {category} Benchmarks\n")
@@ -58,6 +494,14 @@ def main():
         tables.extend(rows)
         tables.append("\n")
 
+        for title, header, divider, category_rows in detail_tables:
+            if detail_rows := category_rows.get(category):
+                tables.append(f"#### {category} {title}\n")
+                tables.append(header)
+                tables.append(divider)
+                tables.extend(detail_rows)
+                tables.append("\n")
+
     start_index = lines.index(START_MARKER) + 1
     end_index = lines.index(END_MARKER)
     lines[start_index:end_index] = tables
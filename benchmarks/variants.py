@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import gc
+from collections.abc import Iterator
+from contextlib import ExitStack, contextmanager
+from typing import Any
+
+
+@contextmanager
+def restoring(owner: Any, attribute: str) -> Iterator[None]:
+    """Restore `owner.attribute` on exit to what it is now, whatever it is
+    set to in between (including instance-level patches of methods, which
+    are removed rather than set back).
+    """
+    shadowed = attribute in vars(owner)
+    original = getattr(owner, attribute)
+    try:
+        yield
+    finally:
+        if shadowed:
+            setattr(owner, attribute, original)
+        elif attribute in vars(owner):
+            delattr(owner, attribute)
+
+
+@contextmanager
+def pipeline_variant(
+    pipeline: Any,
+    enable_xformers: bool = False,
+    use_compile: bool = False,
+    use_nchw_channels: bool = False,
+    vae: Any = None,
+) -> Iterator[None]:
+    """Apply a configuration delta (attention processor, memory format, VAE
+    swap, compilation) to an already loaded diffusers pipeline, and revert
+    it on exit so the next variant starts from the same base pipeline.
+
+    Compiled state can't be reverted in place: the compiled UNET is just
+    dropped in favor of the original one and dynamo's caches (along with
+    the CUDA graphs captured by the reduce-overhead mode) are reset.
+    """
+    import torch
+
+    with ExitStack() as stack:
+        unet = pipeline.unet
+        for owner, attribute in [
+            (pipeline, "unet"),
+            (pipeline, "vae"),
+            # Patched by instrument_diffusers_pipeline/steps.
+            (pipeline, "encode_prompt"),
+            (pipeline, "prepare_latents"),
+            (unet, "forward"),
+            (pipeline.vae, "decode"),
+        ]:
+            stack.enter_context(restoring(owner, attribute))
+
+        attention = [
+            (module, module.attn_processors)
+            for module in pipeline.components.values()
+            if hasattr(module, "attn_processors")
+        ]
+
+        @stack.callback
+        def restore_attention() -> None:
+            for module, processors in attention:
+                module.set_attn_processor(processors)
+
+        if vae is not None:
+            pipeline.vae = vae
+
+        # Use XFormers memory efficient attention instead of Torch SDPA
+        # which might also utilize memory efficient attention (alongside
+        # flash attention).
+        if enable_xformers:
+            pipeline.enable_xformers_memory_efficient_attention()
+
+        if use_nchw_channels:
+            unet.to(memory_format=torch.channels_last)
+            stack.callback(unet.to, memory_format=torch.contiguous_format)
+
+        # The mode here is reduce-overhead, which is a balanced compromise between
+        # compilation time and runtime. The other modes might be a possible choice
+        # for future benchmarks.
+        if use_compile:
+            pipeline.unet = torch.compile(unet, fullgraph=True, mode="reduce-overhead")
+            stack.callback(torch._dynamo.reset)
+
+        yield
+
+    gc.collect()
+    torch.cuda.empty_cache()
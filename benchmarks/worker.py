@@ -0,0 +1,37 @@
+"""Entry point of the worker processes of LocalSubprocessExecutor: reads
+pickled jobs from stdin until it is closed, runs each benchmark function
+and pickles its results (or the error it raised) to the given fd.
+"""
+import importlib
+import pickle
+import sys
+import traceback
+
+from benchmarks.executors import unwrap
+from benchmarks.failures import BenchmarkError
+
+
+def main() -> None:
+    [results_fd] = sys.argv[1:]
+    jobs = sys.stdin.buffer
+    with open(int(results_fd), "wb") as results_stream:
+        while True:
+            try:
+                job = pickle.load(jobs)
+            except EOFError:
+                break
+
+            module = importlib.import_module(job["module"])
+            function = unwrap(getattr(module, job["function"]))
+            try:
+                results = function(**job["kwargs"])
+            except Exception as exc:
+                traceback.print_exc()
+                results = BenchmarkError.wrap(exc)
+
+            pickle.dump(results, results_stream)
+            results_stream.flush()
+
+
+if __name__ == "__main__":
+    main()
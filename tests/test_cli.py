@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).parent.parent
+
+
+def run_session(results_dir: Path, *args: str) -> str:
+    process = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks",
+            str(results_dir),
+            "--executor=in-process",
+            "--benchmark-module=benchmarks.stub",
+            "--session-id=stub",
+            "--warmup-iterations=1",
+            "--iterations=3",
+            "--retry-backoff=0",
+            f"--history={results_dir / 'history.sqlite'}",
+            *args,
+        ],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return process.stdout
+
+
+def test_stub_session(tmp_path: Path) -> None:
+    run_session(tmp_path)
+    session_file = tmp_path / "stub.json"
+    session = json.loads(session_file.read_text())
+
+    results = {result["name"]: result for result in session["timings"]}
+    assert set(results) == {"Stub (fast)", "Stub (slow)", "Stub (flaky)"}
+    assert all(len(result["timings"]) == 3 for result in results.values())
+    assert session["failures"] == []
+
+    # The flaky benchmark ran out of memory once, and was retried.
+    assert results["Stub (flaky)"]["worker"]["attempts"] == 2
+    assert results["Stub (fast)"]["worker"]["attempts"] == 1
+
+    # The journal is compacted into the session file.
+    assert not session_file.with_suffix(".jsonl").exists()
+
+    with sqlite3.connect(tmp_path / "history.sqlite") as connection:
+        assert connection.execute("SELECT COUNT(*) FROM sessions").fetchone() == (1,)
+
+    # Nothing changed, so all the results are reused.
+    output = run_session(tmp_path)
+    assert output.count("(already run)") == 3
+    assert json.loads(session_file.read_text())["timings"] == session["timings"]
+
+    # An interrupted run (with a torn last line in its journal) is resumed
+    # from the results it journaled, even when forced to run everything.
+    journal = session_file.with_suffix(".jsonl")
+    fast = results["Stub (fast)"]
+    journal.write_text(
+        json.dumps({"settings": session["settings"]})
+        + "\n"
+        + json.dumps(fast)
+        + "\n"
+        + json.dumps(results["Stub (slow)"])[:20]
+    )
+    output = run_session(tmp_path, "--force-run")
+    assert output.count("(resumed from the journal)") == 1
+
+    resumed = json.loads(session_file.read_text())
+    assert fast in resumed["timings"]
+    assert len(resumed["timings"]) == 3
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import itertools
+import time
+
+import pytest
+
+from benchmarks.telemetry import (
+    TelemetrySample,
+    TelemetrySampler,
+    count_foreign_processes,
+)
+
+
+def sample(at: float, **kwargs) -> TelemetrySample:
+    return TelemetrySample(
+        time=at,
+        sm_clock=1980,
+        memory_clock=1593,
+        temperature=60,
+        power=300.0,
+        utilization=100,
+        **kwargs,
+    )
+
+
+class FakeBackend:
+    def __init__(self, samples: list[TelemetrySample]) -> None:
+        self.samples = itertools.cycle(samples)
+
+    def sample(self) -> TelemetrySample:
+        return next(self.samples)
+
+
+SAMPLES = [
+    sample(1.0),
+    sample(2.0, throttled=True),
+    sample(3.0, foreign_processes=1),
+    sample(4.0, power_capped=True),
+]
+
+
+def test_sampler_collects_from_the_backend() -> None:
+    sampler = TelemetrySampler(FakeBackend(SAMPLES), interval=0.001)
+    sampler.start()
+    while len(sampler.samples) < len(SAMPLES):
+        time.sleep(0.001)
+    sampler.stop()
+
+    assert sampler.samples[: len(SAMPLES)] == SAMPLES
+
+
+def test_flag_and_summary() -> None:
+    sampler = TelemetrySampler(FakeBackend(SAMPLES))
+    sampler.samples = list(SAMPLES)
+    windows = [(0.5, 1.5), (1.5, 2.5), (2.5, 3.5), (3.5, 4.5)]
+
+    # Power capping is how the GPU normally runs under load, so only the
+    # throttled and shared samples flag their iterations.
+    assert sampler.flag(windows) == [1, 2]
+
+    summary = sampler.summary(windows)
+    assert summary["throttled_fraction"] == pytest.approx(0.25)
+    assert summary["power_capped_fraction"] == pytest.approx(0.25)
+    assert summary["max_foreign_processes"] == 1
+    assert summary["flagged_iterations"] == [1, 2]
+
+
+def test_summary_without_samples() -> None:
+    assert TelemetrySampler(None).summary([(0.0, 1.0)]) is None
+
+
+def test_count_foreign_processes() -> None:
+    assert count_foreign_processes([]) == 0
+    # Our own process, whichever PID it is listed under.
+    assert count_foreign_processes([12345]) == 0
+    assert count_foreign_processes([12345, 67890]) == 1